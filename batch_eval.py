@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from board import decode_position
+from move_scoring import MoveEvaluator
+
+_evaluators = {}
+
+
+def _evaluator(width: int, height: int) -> MoveEvaluator:
+    # Tables are built once per board size and worker
+    key = (width, height)
+    if key not in _evaluators:
+        _evaluators[key] = MoveEvaluator(width, height)
+    return _evaluators[key]
+
+
+def analyze(text: str) -> dict:
+    # Best move, number of empty cells some ball can reach, number of moves
+    # that clear a line and the best move's value for one encoded position
+    board, next_spawn = decode_position(text)
+    evaluator = _evaluator(board.width, board.height)
+    features = evaluator.evaluate(board)
+    if not len(features.balls):
+        return {"move": None, "targets": 0, "lines": 0, "value": None}
+
+    values = evaluator.values(features, [index for index, color in next_spawn])
+    best = int(values.argmax())
+    return {
+        "move": [int(features.balls[best]), int(features.targets[best])],
+        "targets": len(set(features.targets.tolist())),
+        "lines": int((features.score > 0).sum()),
+        "value": round(float(values[best]), 3),
+    }
+
+
+def _analyze_lines(lines: list) -> list:
+    results = []
+    for line in lines:
+        try:
+            results.append(json.dumps(analyze(line)))
+        except ValueError as e:
+            results.append(json.dumps({"error": str(e)}))
+        except Exception as e:
+            # A position the evaluator cannot handle must not stop the stream
+            results.append(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+    return results
+
+
+def evaluate_stream(source, output, processes: int = None, chunk: int = 64, in_flight: int = None):
+    # Reads positions line by line and writes one JSON line per position in
+    # input order. At most in_flight chunks are queued or waiting to be
+    # written, so memory does not grow with the input.
+    in_flight = in_flight or 4 * (processes or os.cpu_count())
+    with Pool(processes) as pool:
+        pending = deque()
+        lines = (line.rstrip("\n") for line in source)
+        while True:
+            block = list(islice(lines, chunk))
+            if block:
+                pending.append(pool.apply_async(_analyze_lines, (block,)))
+            while pending and (len(pending) >= in_flight or not block):
+                output.write("".join(result + "\n" for result in pending.popleft().get()))
+            if not block:
+                break
+        output.flush()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Evaluate encoded positions, one per line (see board.encode_position).")
+    parser.add_argument("input", nargs="?", default="-", help="positions file (default: stdin)")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk", type=int, default=64, help="positions sent to a worker at once")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    try:
+        evaluate_stream(source, sys.stdout, args.processes, args.chunk)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import time
+from random import Random
+
+import numpy as np
+
+from board import Board, COLORS, LINE_STEPS
+from engine import LinesGame
+from enums import GameDifficulty
+
+
+class BitBoard:
+    # Board held as Python ints, one bit per cell: a mask of occupied cells
+    # and one mask per color. Rows are width + 1 bits apart and the extra
+    # guard bit of every row is never set, so a shift by one column cannot
+    # wrap into the next row. Cell indexes in and out are Board's
+    # y * width + x; bit positions stay inside this class.
+    def __init__(self, width: int = 10, height: int = 10, colors: tuple = COLORS):
+        self.width = width
+        self.height = height
+        self.stride = width + 1
+        self.colors = tuple(colors)
+        self.occupied = 0
+        self.masks = {color: 0 for color in self.colors}
+
+        self.bits = [1 << (y * self.stride + x) for y in range(height) for x in range(width)]
+        self.cells_mask = sum(self.bits)
+        # Shift per (dy, dx) step, same direction order as Board.line_at
+        self.line_shifts = tuple((direction, tuple(dy * self.stride + dx for dy, dx in steps))
+                                 for direction, steps in LINE_STEPS)
+
+    @classmethod
+    def from_board(cls, board: Board, colors: tuple = COLORS):
+        bitboard = cls(board.width, board.height, colors)
+        for index, color in enumerate(board.cells):
+            if color is not None:
+                bitboard.masks[color] |= bitboard.bits[index]
+        bitboard.occupied = sum(bitboard.masks.values())
+        return bitboard
+
+    def to_board(self) -> Board:
+        cells = [None] * (self.width * self.height)
+        for color, mask in self.masks.items():
+            for index in self.indexes(mask):
+                cells[index] = color
+        return Board(self.width, self.height, cells)
+
+    @property
+    def empty(self) -> int:
+        return self.cells_mask & ~self.occupied
+
+    def indexes(self, mask: int) -> list:
+        indexes = []
+        stride, width = self.stride, self.width
+        while mask:
+            low = mask & -mask
+            y, x = divmod(low.bit_length() - 1, stride)
+            indexes.append(y * width + x)
+            mask ^= low
+        return indexes
+
+    def to_array(self, mask: int) -> np.ndarray:
+        # Bool per cell index, for handing masks to numpy code
+        return self.to_arrays([mask])[0]
+
+    def to_arrays(self, masks: list) -> np.ndarray:
+        # One to_array row per mask, unpacked in one go
+        size = self.height * self.stride
+        length = (size + 7) // 8
+        data = np.frombuffer(b"".join(mask.to_bytes(length, "little") for mask in masks), dtype=np.uint8)
+        grid = np.unpackbits(data.reshape(len(masks), length), axis=1, count=size, bitorder="little")
+        return grid.reshape(len(masks), self.height, self.stride)[:, :, :self.width].reshape(len(masks), -1).astype(bool)
+
+    def from_array(self, cells: np.ndarray) -> int:
+        grid = np.zeros((self.height, self.stride), dtype=bool)
+        grid[:, :self.width] = np.asarray(cells, dtype=bool).reshape(self.height, self.width)
+        return int.from_bytes(np.packbits(grid.reshape(-1), bitorder="little").tobytes(), "little")
+
+    def color_at(self, index: int) -> str:
+        bit = self.bits[index]
+        if self.occupied & bit:
+            for color, mask in self.masks.items():
+                if mask & bit:
+                    return color
+        return None
+
+    def set(self, index: int, color: str):
+        self.clear(index)
+        self.masks[color] |= self.bits[index]
+        self.occupied |= self.bits[index]
+
+    def clear(self, index: int):
+        bit = self.bits[index]
+        if self.occupied & bit:
+            self.occupied &= ~bit
+            for color in self.masks:
+                self.masks[color] &= ~bit
+
+    def move(self, ball: int, target: int):
+        self.set(target, self.color_at(ball))
+        self.clear(ball)
+
+    def _neighbours(self, mask: int) -> int:
+        stride = self.stride
+        return mask << 1 | mask >> 1 | mask << stride | mask >> stride
+
+    def _flood(self, seeds: int, empty: int) -> int:
+        # Grows seeds one 4-connected step per round; the carry of
+        # empty + reach also runs every row segment to its right end at once
+        stride = self.stride
+        reach = seeds & empty
+        while True:
+            grown = reach | (empty & ((empty + reach) ^ empty))
+            grown = (grown | grown >> 1 | grown << stride | grown >> stride) & empty
+            if grown == reach:
+                return reach
+            reach = grown
+
+    def reachable(self, start: int) -> int:
+        # Mask of the empty cells a ball at start can travel to
+        empty = self.empty
+        return self._flood(self._neighbours(self.bits[start]) & empty, empty)
+
+    def can_move(self, ball: int, target: int) -> bool:
+        return bool(self.reachable(ball) & self.bits[target])
+
+    def split(self, seeds: int, mask: int) -> list:
+        # Masks of the 4-connected parts of mask holding the seed cells. A
+        # flood stops as soon as it has reached all the seeds left, so the
+        # last part is just what is left of mask, parts without seeds too.
+        stride = self.stride
+        parts = []
+        while seeds:
+            reach = seeds & -seeds
+            while reach & seeds != seeds:
+                grown = reach | (mask & ((mask + reach) ^ mask))
+                grown = (grown | grown >> 1 | grown << stride | grown >> stride) & mask
+                if grown == reach:
+                    break
+                reach = grown
+            else:
+                parts.append(mask)
+                return parts
+            parts.append(reach)
+            mask &= ~reach
+            seeds &= ~reach
+        return parts
+
+    def components(self, mask: int) -> list:
+        # Masks of the 4-connected parts of mask
+        components = []
+        while mask:
+            component = self._flood(mask & -mask, mask)
+            components.append(component)
+            mask &= ~component
+        return components
+
+    def regions(self) -> list:
+        # Masks of the 4-connected empty regions
+        return self.components(self.empty)
+
+    def targets(self) -> dict:
+        # Reachable-cell mask of every ball that can move
+        regions = self.regions()
+        targets = {}
+        occupied = self.occupied
+        for region in regions:
+            # Balls next to the region, found with one shift of the region
+            border = self._neighbours(region) & occupied
+            while border:
+                low = border & -border
+                targets[low] = targets.get(low, 0) | region
+                border ^= low
+        stride, width = self.stride, self.width
+        moves = {}
+        for low, mask in targets.items():
+            y, x = divmod(low.bit_length() - 1, stride)
+            moves[y * width + x] = mask
+        return moves
+
+    def runs(self, mask: int, shift: int, length: int) -> int:
+        # Cells of mask lying on runs of at least length cells along shift
+        starts = mask
+        for k in range(1, length):
+            starts &= mask >> (k * shift)
+            if not starts:
+                return 0
+        cells = starts
+        for k in range(1, length):
+            cells |= starts << (k * shift)
+        return cells
+
+    def lines(self, items_in_line: int = LinesGame.ITEMS_IN_LINE) -> dict:
+        # Mask of the cells on a line of items_in_line or more, per color
+        shifts = [steps[1] for direction, steps in self.line_shifts]
+        lines = {}
+        for color, mask in self.masks.items():
+            if mask.bit_count() < items_in_line:
+                continue
+            cells = 0
+            for shift in shifts:
+                cells |= self.runs(mask, shift, items_in_line)
+            if cells:
+                lines[color] = cells
+        return lines
+
+    def line_at(self, index: int, items_in_line: int = LinesGame.ITEMS_IN_LINE):
+        # Same result as Board.line_at, with the cells in the same order
+        color = self.color_at(index)
+        if color is None:
+            return None
+        mask = self.masks[color]
+        bit = self.bits[index]
+        for direction, shifts in self.line_shifts:
+            line = [bit]
+            for shift in shifts:
+                cell = bit
+                while True:
+                    cell = (cell << shift if shift > 0 else cell >> -shift) & mask
+                    if not cell:
+                        break
+                    line.append(cell)
+            if len(line) >= items_in_line:
+                return direction, [self.indexes(cell)[0] for cell in line]
+        return None
+
+
+def compare(board: Board, items_in_line: int = LinesGame.ITEMS_IN_LINE) -> list:
+    # Differences between BitBoard and Board on one position, as messages
+    bitboard = BitBoard.from_board(board)
+    errors = []
+    if bitboard.to_board() != board:
+        errors.append("round trip changed the cells")
+
+    targets = bitboard.targets()
+    for ball in board.balls():
+        expected = board.reachable(ball)
+        if set(bitboard.indexes(bitboard.reachable(ball))) != expected:
+            errors.append(f"reachable({ball}) differs")
+        if set(bitboard.indexes(targets.get(ball, 0))) != expected:
+            errors.append(f"targets()[{ball}] differs")
+        if bitboard.line_at(ball, items_in_line) != board.line_at(ball, items_in_line):
+            errors.append(f"line_at({ball}) differs")
+
+    lines = {}
+    for ball in board.balls():
+        line = board.line_at(ball, items_in_line)
+        if line is not None:
+            lines.setdefault(board.cells[ball], set()).update(line[1])
+    found = {color: set(bitboard.indexes(mask)) for color, mask in bitboard.lines(items_in_line).items()}
+    if found != lines:
+        errors.append("lines() differs")
+    return errors
+
+
+def sample_positions(width: int, height: int, count: int, seed: int = 0) -> list:
+    # Positions from LinesGame games played with random legal moves. Lines
+    # are cleared as soon as they appear, so some are added by hand.
+    rng = Random(seed)
+    game = LinesGame(width, height, seed)
+    positions = []
+    while len(positions) < count:
+        if game.lost:
+            game.reset(rng.randrange(2 ** 32))
+        balls = [ball for ball in game.board.balls() if game.board.reachable(ball)]
+        if not balls:
+            game.reset(rng.randrange(2 ** 32))
+            continue
+        ball = rng.choice(balls)
+        game.apply_move(ball, rng.choice(sorted(game.board.reachable(ball))))
+        board = game.board.copy()
+        if rng.random() < 0.2:
+            y, x = rng.randrange(height), rng.randrange(width - 4)
+            color = rng.choice(game.colors)
+            for k in range(5):
+                board.cells[board.index(y, x + k)] = color
+        positions.append(board)
+    return positions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Cross-check BitBoard against Board and time both.")
+    parser.add_argument("--difficulty", choices=[d.name for d in GameDifficulty], default="HARD")
+    parser.add_argument("-n", "--positions", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    height, width = GameDifficulty[args.difficulty].value
+    positions = sample_positions(width, height, args.positions, args.seed)
+    for number, board in enumerate(positions):
+        errors = compare(board)
+        if errors:
+            raise SystemExit(f"Position {number}: " + ", ".join(errors))
+    print(f"{len(positions)} {width}x{height} positions match Board")
+
+    bitboards = [BitBoard.from_board(board) for board in positions]
+    timings = [
+        ("move targets", lambda board: {ball: board.reachable(ball) for ball in board.balls()},
+         BitBoard.targets),
+        ("all lines", lambda board: [board.line_at(ball) for ball in board.balls()], BitBoard.lines),
+    ]
+    for name, cell_loop, bit_parallel in timings:
+        start = time.perf_counter()
+        for board in positions:
+            cell_loop(board)
+        loop_time = (time.perf_counter() - start) / len(positions)
+        start = time.perf_counter()
+        for bitboard in bitboards:
+            bit_parallel(bitboard)
+        bit_time = (time.perf_counter() - start) / len(positions)
+        print(f"{name:14} Board {loop_time * 1e6:8.1f} us  BitBoard {bit_time * 1e6:8.1f} us  "
+              f"x{loop_time / bit_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+from collections import deque
+
+from enums import CoordinatesMoves, LineDirection
+
+COLORS = ("blue", "cyan", "green", "orange", "red", "yellow")
+
+# One character per cell in position text, "." is an empty cell
+COLOR_LETTERS = {color: color[0] for color in COLORS}
+LETTER_COLORS = {letter: color for color, letter in COLOR_LETTERS.items()}
+# Largest side accepted by decode_position; evaluators build size x size tables
+MAX_POSITION_SIDE = 32
+
+PATH_MOVES = (CoordinatesMoves.RIGHT, CoordinatesMoves.DOWN, CoordinatesMoves.LEFT, CoordinatesMoves.UP)
+
+LINE_STEPS = tuple((direction, tuple(move.value for move in direction.value)) for direction in LineDirection)
+
+_neighbour_tables = {}
+
+
+class Board:
+    # Qt-free copy of a GameField position: cells are color names (or None)
+    # in row-major order, so index = y * width + x.
+    def __init__(self, width: int = 10, height: int = 10, cells: list = None):
+        self.width = width
+        self.height = height
+        self.cells = list(cells) if cells is not None else [None] * (width * height)
+
+    @classmethod
+    def from_field(cls, field):
+        return cls(field.width, field.height, [i.color for i in field.fieldItems])
+
+    def copy(self):
+        return Board(self.width, self.height, self.cells)
+
+    def __eq__(self, other):
+        return (isinstance(other, Board) and self.width == other.width and
+                self.height == other.height and self.cells == other.cells)
+
+    def __repr__(self):
+        return f"Board({self.width}x{self.height}, {len(self.balls())} balls)"
+
+    def index(self, y: int, x: int) -> int:
+        return y * self.width + x
+
+    def coords(self, index: int) -> tuple:
+        return divmod(index, self.width)
+
+    def balls(self) -> list:
+        return [i for i, c in enumerate(self.cells) if c is not None]
+
+    def empties(self) -> list:
+        return [i for i, c in enumerate(self.cells) if c is None]
+
+    def neighbours(self, index: int) -> tuple:
+        return self.neighbour_table(self.width, self.height)[index]
+
+    @staticmethod
+    def neighbour_table(width: int, height: int) -> tuple:
+        key = (width, height)
+        table = _neighbour_tables.get(key)
+        if table is None:
+            table = []
+            for index in range(width * height):
+                y, x = divmod(index, width)
+                cells = []
+                for move in PATH_MOVES:
+                    ny, nx = y + move.value[0], x + move.value[1]
+                    if 0 <= ny < height and 0 <= nx < width:
+                        cells.append(ny * width + nx)
+                table.append(tuple(cells))
+            table = _neighbour_tables[key] = tuple(table)
+        return table
+
+    def reachable(self, start: int) -> set:
+        # Empty cells a ball at start can travel to
+        cells = self.cells
+        neighbours = self.neighbour_table(self.width, self.height)
+        seen = set()
+        queue = deque([start])
+        while queue:
+            index = queue.popleft()
+            for n in neighbours[index]:
+                if cells[n] is None and n not in seen:
+                    seen.add(n)
+                    queue.append(n)
+        return seen
+
+    def find_path(self, start: int, end: int) -> list:
+        cells = self.cells
+        neighbours = self.neighbour_table(self.width, self.height)
+        came_from = {start: None}
+        queue = deque([start])
+        while queue:
+            index = queue.popleft()
+            if index == end:
+                path = []
+                while index is not None:
+                    path.append(index)
+                    index = came_from[index]
+                return path[::-1]
+            for n in neighbours[index]:
+                if cells[n] is None and n not in came_from:
+                    came_from[n] = index
+                    queue.append(n)
+        return []
+
+    def empty_regions(self) -> tuple:
+        # Label 4-connected empty regions 1..count, occupied cells get 0.
+        # Two-pass scan with union-find: provisional labels from the left and
+        # upper neighbours, then every label is replaced by its root.
+        cells, width = self.cells, self.width
+        labels = [0] * len(cells)
+        parent = [0]
+
+        def root(label):
+            while parent[label] != label:
+                parent[label] = parent[parent[label]]
+                label = parent[label]
+            return label
+
+        for index, color in enumerate(cells):
+            if color is not None:
+                continue
+            up = labels[index - width] if index >= width else 0
+            left = labels[index - 1] if index % width else 0
+            if up and left:
+                up, left = root(up), root(left)
+                if up < left:
+                    up, left = left, up
+                labels[index] = left
+                parent[up] = left
+            elif up or left:
+                labels[index] = up or left
+            else:
+                labels[index] = len(parent)
+                parent.append(len(parent))
+
+        count = 0
+        final = [0] * len(parent)
+        for label in range(1, len(parent)):
+            if parent[label] == label:
+                count += 1
+                final[label] = count
+            else:
+                final[label] = final[root(label)]
+        return [final[label] for label in labels], count
+
+    def line_at(self, index: int, items_in_line: int = 5):
+        # Same rules as FieldItem.calculate_line: the first direction holding
+        # items_in_line or more balls of the cell's color wins.
+        color = self.cells[index]
+        if color is None:
+            return None
+        cells, width, height = self.cells, self.width, self.height
+        y, x = divmod(index, width)
+        for direction, steps in LINE_STEPS:
+            line = [index]
+            for dy, dx in steps:
+                ny, nx = y + dy, x + dx
+                while 0 <= ny < height and 0 <= nx < width and cells[ny * width + nx] == color:
+                    line.append(ny * width + nx)
+                    ny, nx = ny + dy, nx + dx
+            if len(line) >= items_in_line:
+                return direction, line
+        return None
+
+
+def encode_position(board: Board, next_spawn: list = ()) -> str:
+    # "10x10 ..b.r... 12y,40r": size, cells, then the upcoming spawns as
+    # cell and color letter ("-" when there are none)
+    cells = "".join(COLOR_LETTERS[c] if c else "." for c in board.cells)
+    spawns = ",".join(f"{index}{COLOR_LETTERS[color]}" for index, color in next_spawn) or "-"
+    return f"{board.width}x{board.height} {cells} {spawns}"
+
+
+def decode_position(text: str) -> tuple:
+    # (board, next_spawn) from encode_position's text; the spawns are optional
+    fields = text.split()
+    if len(fields) not in (2, 3):
+        raise ValueError(f"Expected 'WxH cells [spawns]', got {len(fields)} fields")
+    width, height = (int(n) for n in fields[0].lower().split("x"))
+    if not (1 <= width <= MAX_POSITION_SIDE and 1 <= height <= MAX_POSITION_SIDE):
+        raise ValueError(f"Board size {width}x{height} is outside 1x1 to {MAX_POSITION_SIDE}x{MAX_POSITION_SIDE}")
+    if len(fields[1]) != width * height:
+        raise ValueError(f"Expected {width * height} cells, got {len(fields[1])}")
+    try:
+        cells = [None if letter == "." else LETTER_COLORS[letter] for letter in fields[1]]
+        next_spawn = []
+        if len(fields) == 3 and fields[2] != "-":
+            for spawn in fields[2].split(","):
+                index = int(spawn[:-1])
+                if not 0 <= index < width * height:
+                    raise ValueError(f"Spawn cell {index} is off the board")
+                next_spawn.append((index, LETTER_COLORS[spawn[-1]]))
+    except KeyError as e:
+        raise ValueError(f"Unknown color letter {e}") from None
+    return Board(width, height, cells), next_spawn
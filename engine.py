@@ -0,0 +1,136 @@
+from array import array
+from collections import Counter, namedtuple
+from random import Random, randrange
+
+from board import Board, COLORS
+from enums import GameDifficulty
+from game_stats import GameRecord
+
+# path: cells walked by the ball (empty when the move was not checked)
+# line: cells cleared by the move, spawned: (cell, color) pairs added after it
+TurnResult = namedtuple("TurnResult", ["ball", "target", "path", "line", "score", "spawned"])
+
+
+class LinesGame:
+    # Qt-free GameField: same spawn order, random number use, line and loss
+    # rules, so a seed and a list of moves replay the same game in both.
+    ITEMS_IN_LINE = 5
+    SPAWN_PER_TURN = 3
+
+    def __init__(self, width: int = 10, height: int = 10, seed: int = None, colors: tuple = COLORS):
+        self.width = width
+        self.height = height
+        self.colors = list(colors)
+        self.rng = Random()
+        self.board = Board(width, height)
+        self.reset(seed)
+
+    def reset(self, seed: int = None):
+        self.seed = seed if seed is not None else randrange(2 ** 32)
+        self.rng.seed(self.seed)
+        self.board.cells = [None] * (self.width * self.height)
+        # Mirrors FieldItem.next_color, which is kept after the ball spawns
+        self.next_color = [None] * (self.width * self.height)
+        self.next_spawn = []
+        self.scores = 0
+        self.turns = 0
+        # (filled cells, (direction name, length) or None) per turn, as in
+        # GameField.turn_stats
+        self.turn_stats = []
+        self.lost = False
+        self.spawn_items()
+
+    @property
+    def empty_items_count(self) -> int:
+        return self.board.cells.count(None)
+
+    def spawn_items(self) -> list:
+        if len(self.next_spawn) < self.SPAWN_PER_TURN:
+            self.prepare_next_spawn(self.SPAWN_PER_TURN - len(self.next_spawn))
+
+        spawned = []
+        for index in self.next_spawn:
+            # Like FieldItem.spawn_item this overwrites a ball moved onto a
+            # previewed cell
+            self.board.cells[index] = self.next_color[index]
+            spawned.append((index, self.next_color[index]))
+        self.next_spawn = []
+        self.prepare_next_spawn(self.SPAWN_PER_TURN)
+        return spawned
+
+    def prepare_next_spawn(self, n: int = 0):
+        if n == 0:
+            n = self.SPAWN_PER_TURN
+        cells = self.board.cells
+        empty_items_count = cells.count(None)
+        if empty_items_count == 0:
+            return
+        elif n > empty_items_count:
+            n = empty_items_count
+
+        # Same draws as GameField.prepare_next_spawn, repeats included
+        positions = []
+        size = len(cells)
+        while len(positions) < n:
+            index = self.rng.choice(range(size))
+            if cells[index] is None:
+                positions.append(index)
+                self.next_color[index] = self.rng.choice(self.colors)
+        self.next_spawn = positions
+
+        if empty_items_count <= len(positions):
+            self.lost = True
+
+    def move(self, ball: int, target: int) -> TurnResult:
+        if self.board.cells[ball] is None or self.board.cells[target] is not None:
+            raise ValueError(f"Can't move from {ball} to {target}")
+        path = self.board.find_path(ball, target)
+        if not path:
+            raise ValueError(f"No path from {ball} to {target}")
+        return self.apply_move(ball, target, path)
+
+    def apply_move(self, ball: int, target: int, path: list = ()) -> TurnResult:
+        # Unchecked move, for callers that already know it is legal
+        cells = self.board.cells
+        cells[target], cells[ball] = cells[ball], None
+
+        score = 0
+        spawned = []
+        line = self.board.line_at(target, self.ITEMS_IN_LINE)
+        if line is not None:
+            direction, line = line
+            for index in line:
+                cells[index] = None
+            score = 5 * len(line)
+            self.scores += score
+            turn_line = (direction.name, len(line))
+        else:
+            line = []
+            turn_line = None
+            spawned = self.spawn_items()
+        self.turns += 1
+        self.turn_stats.append((len(cells) - cells.count(None), turn_line))
+        return TurnResult(ball, target, list(path), line, score, spawned)
+
+    @property
+    def difficulty_name(self) -> str:
+        try:
+            return GameDifficulty((self.height, self.width)).name
+        except ValueError:
+            return "CUSTOM"
+
+    def game_record(self, source: str = "sim") -> GameRecord:
+        # Same record as GameField.game_record, for GameStatsStore
+        lines = Counter(line for filled, line in self.turn_stats if line is not None)
+        return GameRecord(
+            seed=self.seed,
+            difficulty=self.difficulty_name,
+            width=self.width,
+            height=self.height,
+            score=self.scores,
+            turns=self.turns,
+            finished=self.lost,
+            source=source,
+            lines=tuple((direction, length, count) for (direction, length), count in lines.items()),
+            fullness=array("H", [filled for filled, line in self.turn_stats]).tobytes()
+        )
@@ -18,7 +18,20 @@ class CoordinatesMoves(Enum):
     DOWN_RIGHT = (1, 1)
 
 
+class AnimationMode(Enum):
+    NORMAL = 0
+    CAPPED = 1
+    INSTANT = 2
+
+
 class GameDifficulty(Enum):
     EASY = (10, 10)
     MEDIUM = (12, 12)
     HARD = (15, 15)
+
+
+class LineDirection(Enum):
+    HORIZONTAL = (CoordinatesMoves.LEFT, CoordinatesMoves.RIGHT)
+    VERTICAL = (CoordinatesMoves.UP, CoordinatesMoves.DOWN)
+    DIAGONAL = (CoordinatesMoves.UP_LEFT, CoordinatesMoves.DOWN_RIGHT)
+    ANTI_DIAGONAL = (CoordinatesMoves.UP_RIGHT, CoordinatesMoves.DOWN_LEFT)
@@ -0,0 +1,255 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from random import Random
+
+import numpy as np
+
+from board import Board
+from engine import LinesGame
+from game_stats import GameStatsStore
+
+_neighbour_arrays = {}
+
+
+def _neighbour_array(width: int, height: int) -> np.ndarray:
+    # 4-connected neighbours per cell, padded with the off-board index
+    key = (width, height)
+    if key not in _neighbour_arrays:
+        size = width * height
+        table = np.full((size, 4), size, dtype=np.intp)
+        for index, cells in enumerate(Board.neighbour_table(width, height)):
+            table[index, :len(cells)] = cells
+        _neighbour_arrays[key] = table
+    return _neighbour_arrays[key]
+
+
+def action_mask(board: Board, out: np.ndarray = None) -> np.ndarray:
+    # mask[ball * size + target]: target is empty and reachable from ball
+    size = board.width * board.height
+    labels, count = board.empty_regions()
+    labels = np.array(labels + [0], dtype=np.intp)
+    occupied = labels[:-1] == 0
+
+    adjacency = np.zeros((size, count + 1), dtype=bool)
+    adjacency[np.arange(size)[:, None], labels[_neighbour_array(board.width, board.height)]] = True
+    adjacency[:, 0] = False
+    adjacency[~occupied] = False
+
+    if out is None:
+        out = np.empty(size * size, dtype=bool)
+    out.reshape(size, size)[:] = adjacency[:, labels[:-1]]
+    return out
+
+
+class LinesEnv:
+    # Gym-style single game. Actions are ball * size + target, observations
+    # are (2, height, width) int8: ball colors and upcoming spawn colors, as
+    # 1-based indexes into LinesGame.colors (0 = none). With a stats store
+    # every game with at least one turn is recorded when it is reset.
+    INVALID_ACTION_REWARD = -1.0
+
+    def __init__(self, width: int = 10, height: int = 10, seed: int = None, mask: np.ndarray = None,
+                 stats: GameStatsStore = None):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.stats = stats
+        self.game = LinesGame(width, height, seed)
+        self._codes = {color: i + 1 for i, color in enumerate(self.game.colors)}
+        self._codes[None] = 0
+        # The mask is updated in place, so it may be a view of a shared buffer
+        self._mask = mask if mask is not None else np.empty(self.size * self.size, dtype=bool)
+        self.refresh_mask()
+
+    @property
+    def observation_shape(self) -> tuple:
+        return 2, self.height, self.width
+
+    @property
+    def action_count(self) -> int:
+        return self.size * self.size
+
+    def refresh_mask(self):
+        action_mask(self.game.board, self._mask)
+
+    def action_mask(self) -> np.ndarray:
+        return self._mask
+
+    def observation(self, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty(self.observation_shape, dtype=np.int8)
+        codes = self._codes
+        out[0].flat[:] = [codes[c] for c in self.game.board.cells]
+        out[1] = 0
+        spawn = out[1].reshape(-1)
+        for index in self.game.next_spawn:
+            spawn[index] = codes[self.game.next_color[index]]
+        return out
+
+    def record_stats(self):
+        if self.stats is not None and self.game.turns > 0:
+            self.stats.record(self.game.game_record("env"))
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        self.record_stats()
+        self.game.reset(seed)
+        self.refresh_mask()
+        return self.observation()
+
+    def play(self, action: int) -> tuple:
+        # step() without building the observation. An illegal action leaves
+        # the board as it is and gets INVALID_ACTION_REWARD.
+        if self.game.lost:
+            raise RuntimeError("step() called on a finished game, call reset()")
+        if not 0 <= action < self.action_count or not self._mask[action]:
+            return self.INVALID_ACTION_REWARD, False, {"invalid": True}
+
+        ball, target = divmod(int(action), self.size)
+        result = self.game.apply_move(ball, target)
+        self.refresh_mask()
+        done = self.game.lost or not self._mask.any()
+        return float(result.score), done, {"scores": self.game.scores, "turns": self.game.turns, "line": result.line}
+
+    def step(self, action: int) -> tuple:
+        reward, done, info = self.play(action)
+        return self.observation(), reward, done, info
+
+
+def _worker(connection, names: dict, num_envs: int, first: int, count: int, width: int, height: int,
+            stats_path: str = None):
+    blocks = {name: SharedMemory(name=shm) for name, shm in names.items()}
+    arrays = _shared_arrays(blocks, num_envs, width, height)
+    # Each worker writes through its own store; SQLite assigns the ids
+    stats = GameStatsStore(stats_path) if stats_path else None
+    envs = [LinesEnv(width, height, mask=arrays["masks"][i], stats=stats) for i in range(first, first + count)]
+    # Seeds of auto-reset games follow from the seed each env was reset with
+    reseeds = [Random() for _ in envs]
+    try:
+        while True:
+            command = connection.recv()
+            if command == "step":
+                for i, (env, reseed) in enumerate(zip(envs, reseeds), first):
+                    reward, done, info = env.play(int(arrays["actions"][i]))
+                    arrays["rewards"][i] = reward
+                    arrays["dones"][i] = done
+                    arrays["scores"][i] = env.game.scores
+                    if done:
+                        env.reset(reseed.randrange(2 ** 32))
+                    env.observation(arrays["observations"][i])
+            elif command == "reset":
+                for i, (env, reseed) in enumerate(zip(envs, reseeds), first):
+                    seed = int(arrays["seeds"][i])
+                    env.reset(seed if seed >= 0 else None)
+                    reseed.seed(env.game.seed)
+                    env.observation(arrays["observations"][i])
+                    arrays["scores"][i] = 0
+            elif command == "close":
+                break
+            connection.send(True)
+    finally:
+        if stats is not None:
+            for env in envs:
+                env.record_stats()
+            stats.close()
+        del envs, arrays
+        for block in blocks.values():
+            block.close()
+        connection.close()
+
+
+def _layout(num_envs: int, width: int, height: int) -> dict:
+    size = width * height
+    return {
+        "observations": ((num_envs, 2, height, width), np.int8),
+        "masks": ((num_envs, size * size), bool),
+        "actions": ((num_envs,), np.int64),
+        "rewards": ((num_envs,), np.float32),
+        "dones": ((num_envs,), bool),
+        "scores": ((num_envs,), np.int64),
+        "seeds": ((num_envs,), np.int64),
+    }
+
+
+def _shared_arrays(blocks: dict, num_envs: int, width: int, height: int) -> dict:
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+        for name, (shape, dtype) in _layout(num_envs, width, height).items()
+    }
+
+
+class VecLinesEnv:
+    # num_envs games split over worker processes. Observations, masks,
+    # actions and rewards live in shared memory; the pipes only carry the
+    # "reset"/"step" commands. Finished games restart by themselves, the
+    # step that ended them reports done=True and the final score in scores.
+    # The returned arrays are overwritten by the next call. With stats_path
+    # the workers record every game to that GameStatsStore file.
+    def __init__(self, num_envs: int, width: int = 10, height: int = 10, num_workers: int = None, context: str = None,
+                 stats_path: str = None):
+        self.num_envs = num_envs
+        self.width = width
+        self.height = height
+        self.action_count = (width * height) ** 2
+        num_workers = min(num_envs, num_workers or mp.cpu_count())
+
+        self._blocks = {
+            name: SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+            for name, (shape, dtype) in _layout(num_envs, width, height).items()
+        }
+        self.arrays = _shared_arrays(self._blocks, num_envs, width, height)
+        names = {name: block.name for name, block in self._blocks.items()}
+
+        ctx = mp.get_context(context)
+        self._connections = []
+        self._processes = []
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(child, names, num_envs, int(first), int(last - first),
+                                                        width, height, stats_path), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        self.closed = False
+
+    def _broadcast(self, command: str):
+        for connection in self._connections:
+            connection.send(command)
+        for connection in self._connections:
+            connection.recv()
+
+    def reset(self, seeds=None) -> np.ndarray:
+        if seeds is None:
+            self.arrays["seeds"][:] = -1
+        else:
+            self.arrays["seeds"][:] = seeds
+        self._broadcast("reset")
+        return self.arrays["observations"]
+
+    def step(self, actions) -> tuple:
+        self.arrays["actions"][:] = actions
+        self._broadcast("step")
+        return self.arrays["observations"], self.arrays["rewards"], self.arrays["dones"], self.arrays["masks"]
+
+    def action_masks(self) -> np.ndarray:
+        return self.arrays["masks"]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self._connections:
+            connection.send("close")
+        for process in self._processes:
+            process.join()
+        self.arrays = None
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
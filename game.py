@@ -1,13 +1,18 @@
 import sys
+from array import array
+from collections import Counter
 from copy import deepcopy
 from itertools import chain
-from random import choice
+from random import Random, randrange
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from about import Ui_Dialog
-from enums import GameStatus, GameDifficulty, CoordinatesMoves
+from enums import GameStatus, GameDifficulty, CoordinatesMoves, LineDirection, AnimationMode
+from game_stats import GameStatsStore, GameRecord
+from history import GameHistory
+from profiling import SessionProfiler
 from resources import Images, Sounds
 
 from lines.path_explorer import GamePathExplorer
@@ -61,6 +66,10 @@ class FieldItem(QPushButton):
         self.next_color = None
         self.color = None
         self.brief_override = None
+        # While a move is animated the cell keeps showing its color from
+        # before the move
+        self.frozen = False
+        self.frozen_color = None
 
         self.current_image = self.parent().images.empty
 
@@ -79,7 +88,7 @@ class FieldItem(QPushButton):
             if self.next_color:
                 self.color = self.next_color
             else:
-                self.color = choice(list(self.parent().images.colors))
+                self.color = self.parent().rng.choice(list(self.parent().images.colors))
         else:
             self.color = color
 
@@ -89,23 +98,13 @@ class FieldItem(QPushButton):
         self.update()
 
     def calculate_line(self) -> bool:
-
-        # [x.value for x in CoordinatesMoves]
-        moves = CoordinatesMoves
-        horizontal_moves = [moves.LEFT, moves.RIGHT]
-        vertical_moves = [moves.UP, moves.DOWN]
-        diagonal1_moves = [moves.UP_LEFT, moves.DOWN_RIGHT]
-        diagonal2_moves = [moves.UP_RIGHT, moves.DOWN_LEFT]
-
-        directions = [horizontal_moves, vertical_moves, diagonal1_moves, diagonal2_moves]
-
         field_items = self.parent().fieldItems2D
         pw, ph = self.parent().width, self.parent().height
         y, x = self.y, self.x
-        for direction in directions:
+        for direction in LineDirection:
             line_elements_count = 1
             line_elements = [self]
-            for move in direction:
+            for move in direction.value:
                 next_y, next_x = y, x
                 while True:
                     next_y, next_x = next_y + move.value[0], next_x + move.value[1]
@@ -126,8 +125,7 @@ class FieldItem(QPushButton):
                 for line_element in line_elements:
                     line_element.reset()
 
-                self.parent().sounds.line_cleared.play()
-                self.parent().scores += 5 * line_elements_count
+                self.parent().line_completed(direction, line_elements_count)
                 return True
         return False
 
@@ -137,6 +135,16 @@ class FieldItem(QPushButton):
     def cancel_override(self):
         self.brief_override = None
 
+    def freeze(self, color: str):
+        self.frozen = True
+        self.frozen_color = color
+        self.update()
+
+    def thaw(self):
+        self.frozen = False
+        self.frozen_color = None
+        self.update()
+
     def paintEvent(self, e: QPaintEvent):
         super().paintEvent(e)
         painter = QPainter(self)
@@ -153,17 +161,22 @@ class FieldItem(QPushButton):
             painter.fillRect(self.rect(), QColor("#f0f0f0"))
             pass
 
+        color, image = self.color, self.current_image
+        if self.frozen:
+            color = self.frozen_color
+            image = self.parent().images.colors.get(color)
+
         if self.parent().SHOW_NEXT_SPAWN:
-            if self.next_color and not self.color:
+            if self.next_color and not color:
                 painter.drawImage(
                     self.rect().marginsAdded(QMargins() - 25),
                     self.parent().images.colors[self.next_color]
                 )
 
-        if self.color:
+        if color:
             painter.drawImage(
                 self.rect().marginsAdded(QMargins() - (5 + int(self.active_sprite_num) * 2)),
-                self.current_image
+                image
             )
 
         painter.end()
@@ -177,6 +190,18 @@ class FieldItem(QPushButton):
     def __str__(self):
         return f"Item ({self.y},{self.x})"
 
+    def restore_state(self, state):
+        self.color = state.color
+        self.next_color = state.next_color
+        self.not_empty = state.color is not None
+        self.brief_override = None
+        if self.color:
+            self.current_image = self.parent().images.colors[self.color]
+        else:
+            self.current_image = self.parent().images.empty
+        self.changed.emit(self)
+        self.update()
+
     def reset(self):
         self.current_image = self.parent().images.empty
         self.not_empty = False
@@ -206,6 +231,9 @@ class GameField(QWidget):
     ITEMS_IN_LINE = 5
     SPAWN_PER_TURN = 3
     SHOW_NEXT_SPAWN = True
+    STEP_INTERVAL = 25
+    # Longest move animation in AnimationMode.CAPPED, in milliseconds
+    CAPPED_MOVE_DURATION = 200
 
     @pyqtSlot(QObject)
     def item_changed_slot(self, item):
@@ -217,6 +245,7 @@ class GameField(QWidget):
 
         self.images = self.parent().images
         self.sounds = self.parent().sounds
+        self.stats = self.parent().stats
 
         self.width = width
         self.height = height
@@ -226,6 +255,18 @@ class GameField(QWidget):
 
         self.ready_to_move_item = False
         self.item_to_move = None
+        self.move_timer = None
+        self.path_to_take = None
+        self.animation_mode = AnimationMode.NORMAL
+        self.frozen_items = []
+
+        self.history = GameHistory()
+
+        self.seed = randrange(2 ** 32)
+        self.rng = Random(self.seed)
+        self.turns = 0
+        self.turn_stats = []
+        self.turn_line = None
 
         self.fieldItems2D = []
 
@@ -287,10 +328,10 @@ class GameField(QWidget):
 
         positions = []
         while len(positions) < n:
-            pos = choice(self.fieldItems)
+            pos = self.rng.choice(self.fieldItems)
             if not pos.not_empty:
                 positions += [pos]
-                pos.next_color = choice(list(self.images.colors))
+                pos.next_color = self.rng.choice(list(self.images.colors))
                 if self.SHOW_NEXT_SPAWN:
                     pos.update()
 
@@ -300,6 +341,10 @@ class GameField(QWidget):
             self.loose()
 
     def item_clicked(self, item: FieldItem):
+        if item.frozen:
+            # The cell still shows the position before the move, so show the
+            # new one before acting on it
+            self.finish_animation()
         if item.not_empty and not self.ready_to_move_item:
             print("Move it now")
             item.active_state = True
@@ -317,73 +362,87 @@ class GameField(QWidget):
         elif self.ready_to_move_item:
             path_to_take = self.find_paths(self.item_to_move, item)
             if len(path_to_take) > 0:
-                timer = QTimer(self)
-                self.move_timer = timer
-                self.path_to_take = path_to_take
-                self.move_timer_ticks_count = -1
-
-                timer.setInterval(25)
-                timer.timeout.connect(self.move_item_by_steps)
-                timer.start()
+                self.move_item(self.item_to_move, item, path_to_take)
+
+    def move_item(self, start_item: FieldItem, end_item: FieldItem, path: list):
+        # The turn is resolved at once, the animation only replays it on
+        # screen, so clicks during it already act on the new position; a
+        # click on a cell that still looks old ends the animation first. A
+        # move made before the previous ball arrives skips to its end.
+        self.finish_animation()
+        shown = [i.color for i in self.fieldItems]
+        color = start_item.color
+        if self.animation_mode != AnimationMode.INSTANT:
+            self.path_to_take = [self.fieldItems2D[p.y()][p.x()] for p in path]
+
+        self.history.begin(*self.position_state())
+        self.turn_line = None
+        self.swap_items(start_item, end_item)
+        start_item.reset()
+
+        if not end_item.calculate_line():
+            self.spawn_items()
+        self.history.commit(*self.position_state())
+        self.end_turn()
 
-    def move_item_by_steps(self):
-        timer = self.move_timer
+        self.ready_to_move_item = False
+        self.item_to_move = None
+        if self.path_to_take is not None:
+            self.animate_move(shown, color)
+
+    def animate_move(self, shown: list, color: str):
+        # Cells changed by the move keep their old look until the ball
+        # arrives, so the moved ball still sits in its old cell while a copy
+        # walks the path.
+        for item, item_color in zip(self.fieldItems, shown):
+            if item.color != item_color:
+                item.freeze(item_color)
+                self.frozen_items.append(item)
+
+        steps = len(self.path_to_take) - 1
+        ticks = steps
+        if self.animation_mode == AnimationMode.CAPPED:
+            # Long paths skip cells instead of ticking faster than the timer
+            ticks = max(1, min(steps, self.CAPPED_MOVE_DURATION // self.STEP_INTERVAL))
+        self.move_timer_ticks_count = 0
+        self.move_ticks = ticks
+        self.moving_color = color
+
+        timer = QTimer(self)
+        self.move_timer = timer
+        timer.setInterval(self.STEP_INTERVAL)
+        timer.timeout.connect(self.animate_step)
+        timer.start()
+
+    def animate_step(self):
         self.move_timer_ticks_count += 1
-
-        start_item_point = self.path_to_take[0]
-        start_item = self.fieldItems2D[start_item_point.y()][start_item_point.x()]
-
-        end_item_point = self.path_to_take[-1]
-        end_item = self.fieldItems2D[end_item_point.y()][end_item_point.x()]
-
-        # first iteration
-        if self.move_timer_ticks_count == 0:
-            current_point = self.path_to_take[0]
-            next_point = self.path_to_take[1]
-        # Normal transit move
-        elif self.move_timer_ticks_count < len(self.path_to_take) - 1:
-            current_point = self.path_to_take[self.move_timer_ticks_count]
-            next_point = self.path_to_take[self.move_timer_ticks_count + 1]
-
-        # Final step
-        else:
-            end_item.cancel_override()
-            self.swap_items(start_item, end_item)
-            start_item.reset()
-
-            if not end_item.calculate_line():
-                self.spawn_items()
-
-            timer.stop()
-            self.ready_to_move_item = False
-            self.item_to_move = None
-            self.path_to_take = None
-            self.move_timer_ticks_count = 0
+        if self.move_timer_ticks_count >= self.move_ticks:
+            self.finish_animation()
             return
 
-        current_item = self.fieldItems2D[current_point.y()][current_point.x()]
-        next_item = self.fieldItems2D[next_point.y()][next_point.x()]
-        next_item.show_briefly(self.images.colors[start_item.color])
-        if self.move_timer_ticks_count > 0:
-            current_item.cancel_override()
-            current_item.reset()
+        steps = len(self.path_to_take) - 1
+        previous_item = self.path_to_take[(self.move_timer_ticks_count - 1) * steps // self.move_ticks]
+        current_item = self.path_to_take[self.move_timer_ticks_count * steps // self.move_ticks]
+        previous_item.cancel_override()
+        previous_item.update()
+        current_item.show_briefly(self.images.colors[self.moving_color])
         current_item.update()
-        next_item.update()
-        pass
-        # current_point = self.path_to_take[self.move_timer_ticks_count - 1]
-        # next_point = self.path_to_take[self.move_timer_ticks_count]
-        #
-        # current_item = self.fieldItems2D[current_point.y()][current_point.x()]
-        # next_item = self.fieldItems2D[next_point.y()][next_point.x()]
-        #
-        # next_item.show_briefly(self.images.colors[start_item.color])
-        # if self.move_timer_ticks_count > 0:
-        #     current_item.cancel_override()
-        #     current_item.reset()
-        # current_item.update()
-        # next_item.update()
-
-        # self.move_timer_ticks_count += 1
+
+    def finish_animation(self):
+        if self.path_to_take is None:
+            return
+        if self.move_timer is not None:
+            self.move_timer.stop()
+            self.move_timer = None
+        for item in self.path_to_take:
+            item.cancel_override()
+            item.update()
+        for item in self.frozen_items:
+            item.thaw()
+        self.frozen_items = []
+        self.path_to_take = None
+        if self.turn_line is not None:
+            self.sounds.line_cleared.play()
 
     def move_item_by_steps_o(self):
         timer = self.move_timer
@@ -456,6 +515,83 @@ class GameField(QWidget):
                 break
         return found_path
 
+    def line_completed(self, direction: LineDirection, length: int):
+        # An animated move plays the sound when its ball arrives
+        if self.path_to_take is None:
+            self.sounds.line_cleared.play()
+        self.scores += 5 * length
+        self.turn_line = (direction.name, length)
+
+    def end_turn(self):
+        # Turns rewound by undo are dropped once a new turn is played
+        del self.turn_stats[self.turns:]
+        filled = self.width * self.height - self.empty_items_count
+        self.turn_stats.append((filled, self.turn_line))
+        self.turns += 1
+
+    @property
+    def difficulty_name(self) -> str:
+        try:
+            return GameDifficulty((self.height, self.width)).name
+        except ValueError:
+            return "CUSTOM"
+
+    def game_record(self) -> GameRecord:
+        turn_stats = self.turn_stats[:self.turns]
+        lines = Counter(line for filled, line in turn_stats if line is not None)
+        fullness = array("H", [filled for filled, line in turn_stats])
+        return GameRecord(
+            seed=self.seed,
+            difficulty=self.difficulty_name,
+            width=self.width,
+            height=self.height,
+            score=self.scores,
+            turns=self.turns,
+            finished=self.game_status == GameStatus.LOST,
+            source="play",
+            lines=tuple((direction, length, count) for (direction, length), count in lines.items()),
+            fullness=fullness.tobytes()
+        )
+
+    def record_stats(self):
+        if self.turns > 0:
+            self.stats.record(self.game_record())
+        self.turns = 0
+        self.turn_stats = []
+
+    def position_state(self):
+        cells = [self.history.intern(i.color, i.next_color) for i in self.fieldItems]
+        next_spawn = tuple(i.y * self.width + i.x for i in self.next_spawn)
+        return cells, self.scores, next_spawn
+
+    def restore_position(self, position):
+        cells, scores, next_spawn = position
+        self.finish_animation()
+        if self.item_to_move is not None:
+            self.item_to_move.active_state = False
+        self.ready_to_move_item = False
+        self.item_to_move = None
+
+        # Only the cells changed by the rewound turn are touched; their
+        # update() calls are merged by Qt into a single repaint.
+        for index, state in cells.items():
+            self.fieldItems[index].restore_state(state)
+        self.next_spawn = [self.fieldItems[i] for i in next_spawn]
+        self.scores = scores
+
+    def can_rewind(self) -> bool:
+        return self.game_status == GameStatus.RUNNING
+
+    def undo(self):
+        if self.can_rewind() and self.history.can_undo:
+            self.restore_position(self.history.undo())
+            self.turns -= 1
+
+    def redo(self):
+        if self.can_rewind() and self.history.can_redo:
+            self.restore_position(self.history.redo())
+            self.turns += 1
+
     def swap_items(self, item_from: FieldItem, item_to: FieldItem):
         if item_to.not_empty:
             print(f"{item_to} must be empty")
@@ -493,11 +629,19 @@ class GameField(QWidget):
         self.timer = QTimer(self)
         self.timer.singleShot(3000, self.reset_game)
 
-    def reset_game(self):
+    def reset_game(self, seed: int = None):
         try:
             del self.timer
         except Exception:
             pass
+        self.finish_animation()
+        self.record_stats()
+        self.seed = seed if seed is not None else randrange(2 ** 32)
+        self.rng.seed(self.seed)
+        # Drop the previous game's previews so the seed alone decides the spawns
+        self.next_spawn = []
+        for item in self.fieldItems:
+            item.next_color = None
         list(map(FieldItem.reset, self.fieldItems))
         self.game_status = GameStatus.RUNNING
         list(map(FieldItem.reset, self.fieldItems))
@@ -506,6 +650,7 @@ class GameField(QWidget):
         self.game_reset.emit()
         self.ready_to_move_item = False
         self.item_to_move = None
+        self.history.clear()
         self.spawn_items()
 
 
@@ -558,7 +703,7 @@ class GameActions(QObject):
     def bind(self):
         parent = self.parent()
         self.exit.triggered.connect(parent.close)
-        self.reset.triggered.connect(parent.game_field.reset_game)
+        self.reset.triggered.connect(lambda checked: parent.game_field.reset_game())
         self.toggleSound.triggered.connect(parent.sounds.toggle_sound)
         self.toggleSound.triggered.connect(self.change_sound_icon)
         self.easy.triggered.connect(lambda p=parent: parent.set_difficulty(GameDifficulty.EASY))
@@ -601,6 +746,17 @@ class MainWindow(QMainWindow):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.images = Images()
         self.sounds = Sounds()
+        self.stats = GameStatsStore()
+        self.profiler = SessionProfiler(handlers=[
+            GameField.item_clicked,
+            GameField.move_item,
+            GameField.animate_step,
+            FieldItem.paintEvent,
+            FieldItem.calculate_line,
+        ])
+        self.profile_shortcut = QShortcut(QKeySequence("F12"), self, self.toggle_profiling)
+        self.animation_mode = AnimationMode.NORMAL
+        self.animation_shortcut = QShortcut(QKeySequence("F11"), self, self.cycle_animation_mode)
         # self.setWindowIcon(QIcon(QPixmap.fromImage(self.images.dynamite)))
         self.setWindowTitle("Lines")
         # self.game_actions = GameActions(self)
@@ -614,6 +770,7 @@ class MainWindow(QMainWindow):
 
         height, width = self.difficulty.value
         self.game_field = GameField(height=height, width=width, parent=self)
+        self.game_field.animation_mode = self.animation_mode
         self.game_field.reset_game()
 
         layout = QVBoxLayout(self.mainWidget)
@@ -623,6 +780,9 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.status_bar)
         self.game_field.scores_updated.connect(self.status_bar.update_counter)
 
+        self.undo_shortcut = QShortcut(QKeySequence.Undo, self.mainWidget, self.game_field.undo)
+        self.redo_shortcut = QShortcut(QKeySequence.Redo, self.mainWidget, self.game_field.redo)
+
         # self.game_actions.bind()
 
         layout.addWidget(self.game_field)
@@ -634,6 +794,7 @@ class MainWindow(QMainWindow):
 
     def set_difficulty(self, difficulty: GameDifficulty = GameDifficulty.EASY):
         self.difficulty = difficulty
+        self.game_field.record_stats()
         self.layout().removeWidget(self.mainWidget)
         self.mainWidget.setParent(None)
         self.initialize()
@@ -642,6 +803,27 @@ class MainWindow(QMainWindow):
         self.about_dialog = AboutDialog(self)
         self.about_dialog.exec_()
 
+    def toggle_profiling(self):
+        report = self.profiler.toggle()
+        if report:
+            print(f"Profile saved to {report}")
+        self.setWindowTitle("Lines (profiling)" if self.profiler.running else "Lines")
+
+    def set_animation_mode(self, mode: AnimationMode):
+        self.animation_mode = mode
+        self.game_field.finish_animation()
+        self.game_field.animation_mode = mode
+
+    def cycle_animation_mode(self):
+        modes = list(AnimationMode)
+        self.set_animation_mode(modes[(modes.index(self.animation_mode) + 1) % len(modes)])
+        print(f"Animation mode: {self.animation_mode.name.lower()}")
+
+    def closeEvent(self, e: QCloseEvent):
+        self.game_field.record_stats()
+        self.stats.close()
+        super().closeEvent(e)
+
 
 app = QApplication(sys.argv)
 window = MainWindow()
@@ -649,4 +831,12 @@ explorer = GamePathExplorer(window)
 
 # explorer.show()
 
+if "--profile" in app.arguments():
+    window.toggle_profiling()
+if "--turbo" in app.arguments():
+    window.set_animation_mode(AnimationMode.CAPPED)
+elif "--instant" in app.arguments():
+    window.set_animation_mode(AnimationMode.INSTANT)
 app.exec_()
+if window.profiler.running:
+    window.toggle_profiling()
@@ -0,0 +1,133 @@
+import sqlite3
+import sys
+from collections import namedtuple
+from queue import Queue, Empty
+from threading import Thread
+
+# lines: tuple of (direction, length, count)
+# fullness: bytes of unsigned 16-bit occupied-cell counts, one per turn
+GameRecord = namedtuple("GameRecord", [
+    "seed", "difficulty", "width", "height", "score", "turns", "finished", "source", "lines", "fullness"
+])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    seed INTEGER,
+    difficulty TEXT,
+    width INTEGER,
+    height INTEGER,
+    score INTEGER,
+    turns INTEGER,
+    finished INTEGER,
+    source TEXT,
+    fullness BLOB
+);
+CREATE TABLE IF NOT EXISTS game_lines (
+    game_id INTEGER REFERENCES games(id),
+    direction TEXT,
+    length INTEGER,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS games_difficulty ON games(difficulty, score);
+CREATE INDEX IF NOT EXISTS game_lines_game ON game_lines(game_id);
+"""
+
+
+class GameStatsStore:
+    # Games are queued by record() and written by a single background thread
+    # in batched transactions, so callers never wait on the disk.
+    BATCH_SIZE = 1000
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path: str = "./stats.sqlite3"):
+        self.path = path
+        # Games lost to failed writes; the writer reports them and goes on
+        self.failed = 0
+        self._queue = Queue()
+        self._writer = Thread(target=self._write_loop, name="GameStatsWriter", daemon=True)
+        self._writer.start()
+
+    def record(self, game: GameRecord):
+        self._queue.put(game)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _write_loop(self):
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+
+        closing = False
+        while not closing:
+            try:
+                game = self._queue.get(timeout=self.FLUSH_INTERVAL)
+            except Empty:
+                continue
+
+            batch = []
+            while True:
+                if game is None:
+                    closing = True
+                    break
+                batch.append(game)
+                if len(batch) >= self.BATCH_SIZE:
+                    break
+                try:
+                    game = self._queue.get_nowait()
+                except Empty:
+                    break
+
+            if batch:
+                try:
+                    self._insert(connection, batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"Could not save {len(batch)} games to {self.path}: {e}", file=sys.stderr)
+        connection.close()
+
+    @staticmethod
+    def _insert(connection, batch: list):
+        # SQLite picks the ids, so several stores can share one file
+        with connection:
+            cursor = connection.cursor()
+            for game in batch:
+                cursor.execute(
+                    "INSERT INTO games (seed, difficulty, width, height, score, turns, finished, source, fullness) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (game.seed, game.difficulty, game.width, game.height, game.score,
+                     game.turns, int(game.finished), game.source, bytes(game.fullness))
+                )
+                game_id = cursor.lastrowid
+                cursor.executemany("INSERT INTO game_lines VALUES (?, ?, ?, ?)",
+                                   [(game_id, direction, length, count) for direction, length, count in game.lines])
+
+    def query(self, sql: str, *params) -> list:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def summary(self) -> list:
+        return self.query(
+            "SELECT difficulty, COUNT(*), AVG(score), MAX(score), AVG(turns) FROM games GROUP BY difficulty"
+        )
+
+    def best_games(self, difficulty: str, limit: int = 10) -> list:
+        return self.query(
+            "SELECT seed, score, turns FROM games WHERE difficulty = ? ORDER BY score DESC LIMIT ?",
+            difficulty, limit
+        )
+
+    def lines_summary(self) -> list:
+        return self.query(
+            "SELECT direction, length, SUM(count) FROM game_lines GROUP BY direction, length ORDER BY direction, length"
+        )
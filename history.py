@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+CellState = namedtuple("CellState", ["color", "next_color"])
+
+
+class Turn:
+    # A turn keeps only the cells it changed. Cell states are interned by
+    # GameHistory, so every turn shares the same few CellState objects and
+    # positions are plain indexes into GameField.fieldItems.
+    __slots__ = ("positions", "before", "after", "scores", "next_spawn")
+
+    def __init__(self, positions: tuple, before: tuple, after: tuple, scores: tuple, next_spawn: tuple):
+        self.positions = positions
+        self.before = before
+        self.after = after
+        self.scores = scores
+        self.next_spawn = next_spawn
+
+    def state(self, side: int):
+        cells = self.before if side == 0 else self.after
+        return dict(zip(self.positions, cells)), self.scores[side], self.next_spawn[side]
+
+
+class GameHistory:
+    def __init__(self):
+        self._undo = []
+        self._redo = []
+        self._states = {}
+        self._opened = None
+
+    @property
+    def can_undo(self) -> bool:
+        return len(self._undo) > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return len(self._redo) > 0
+
+    def intern(self, color: str, next_color: str) -> CellState:
+        key = (color, next_color)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = CellState(color, next_color)
+        return state
+
+    def begin(self, cells: list, scores: int, next_spawn: tuple):
+        self._opened = (cells, scores, next_spawn)
+
+    def commit(self, cells: list, scores: int, next_spawn: tuple):
+        if self._opened is None:
+            return
+        cells_before, scores_before, next_spawn_before = self._opened
+        self._opened = None
+
+        positions = tuple(i for i, (a, b) in enumerate(zip(cells_before, cells)) if a is not b)
+        turn = Turn(
+            positions,
+            tuple(cells_before[i] for i in positions),
+            tuple(cells[i] for i in positions),
+            (scores_before, scores),
+            (next_spawn_before, next_spawn)
+        )
+        self._undo.append(turn)
+        self._redo = []
+
+    def undo(self):
+        if not self._undo:
+            return None
+        turn = self._undo.pop()
+        self._redo.append(turn)
+        return turn.state(0)
+
+    def redo(self):
+        if not self._redo:
+            return None
+        turn = self._redo.pop()
+        self._undo.append(turn)
+        return turn.state(1)
+
+    def clear(self):
+        self._undo = []
+        self._redo = []
+        self._opened = None
+
+    def __len__(self):
+        return len(self._undo)
@@ -0,0 +1,334 @@
+from collections import namedtuple
+
+import numpy as np
+
+from bitboard import BitBoard
+from board import COLORS
+from enums import LineDirection
+
+# Features of every legal move, one array element per (ball, target) pair.
+# open_windows has one row per color: the change in the number of
+# items_in_line windows holding only that color and empty cells.
+MoveFeatures = namedtuple("MoveFeatures", [
+    "balls", "targets", "colors", "score", "line_length", "lines_extended", "open_windows", "region_delta"
+])
+
+CandidateMove = namedtuple("CandidateMove", [
+    "ball", "target", "value", "score", "line_length", "lines_extended", "open_windows", "region_delta"
+])
+
+
+class MoveEvaluator:
+    WEIGHTS = {
+        "score": 1.0,
+        "line_length": 2.0,
+        "lines_extended": 0.5,
+        "own_windows": 0.3,
+        "other_windows": 0.1,
+        # Exact only when the ball and the target are within two cells of
+        # each other; further apart it is an estimate that can be too high
+        # (about one legal move in twelve), never too low
+        "region_delta": -1.0,
+        # Move onto a previewed cell that clears nothing: the spawn replaces the ball
+        "overwritten": -10.0,
+    }
+
+    def __init__(self, width: int = 10, height: int = 10, items_in_line: int = 5, colors: tuple = COLORS):
+        self.width = width
+        self.height = height
+        self.items_in_line = items_in_line
+        self.colors = colors
+        self._codes = {color: i + 1 for i, color in enumerate(colors)}
+        self._size = width * height
+
+        self._build_rays()
+        self._build_relations()
+        self._build_windows()
+        self._build_neighbourhood()
+
+    def _step(self, index: int, move, k: int = 1) -> int:
+        # Index of the cell k moves away, or the off-board sentinel
+        y, x = divmod(index, self.width)
+        y, x = y + move.value[0] * k, x + move.value[1] * k
+        if 0 <= y < self.height and 0 <= x < self.width:
+            return y * self.width + x
+        return self._size
+
+    def _build_rays(self):
+        # _rays[d, s, k, cell]: k+1 steps from cell along side s of direction d
+        self._ray_length = max(self.width, self.height) - 1
+        self._rays = np.array([
+            [
+                [[self._step(i, move, k + 1) for i in range(self._size)] for k in range(self._ray_length)]
+                for move in direction.value
+            ]
+            for direction in LineDirection
+        ], dtype=np.intp)
+
+    def _build_relations(self):
+        # _relation[a, b]: ray from a that passes through b (-1 if none),
+        # _distance[a, b]: number of steps along it
+        self._relation = np.full((self._size, self._size + 1), -1, dtype=np.int8)
+        self._distance = np.zeros((self._size, self._size + 1), dtype=np.int16)
+        for d in range(len(LineDirection)):
+            for side in range(2):
+                for k in range(self._ray_length):
+                    cells = self._rays[d, side, k]
+                    on_board = np.flatnonzero(cells < self._size)
+                    self._relation[on_board, cells[on_board]] = 2 * d + side
+                    self._distance[on_board, cells[on_board]] = k + 1
+
+    def _build_windows(self):
+        windows = []
+        directions = []
+        for d, direction in enumerate(LineDirection):
+            move = direction.value[1]
+            for i in range(self._size):
+                window = [self._step(i, move, k) for k in range(self.items_in_line)]
+                if self._size not in window:
+                    windows.append(window)
+                    directions.append(d)
+        self._window_count = len(windows)
+        self._windows = np.array(windows, dtype=np.intp).reshape(-1, self.items_in_line)
+
+        # _cell_windows[cell, direction]: windows holding the cell, padded
+        # with the extra window index
+        self._cell_windows = np.full((self._size, len(LineDirection), self.items_in_line),
+                                     self._window_count, dtype=np.intp)
+        filled = np.zeros((self._size, len(LineDirection)), dtype=np.intp)
+        for w, (window, d) in enumerate(zip(windows, directions)):
+            for i in window:
+                self._cell_windows[i, d, filled[i, d]] = w
+                filled[i, d] += 1
+
+        # Extra all-False row for the padding window index
+        self._contains = np.zeros((self._window_count + 1, self._size + 1), dtype=bool)
+        if windows:
+            self._contains[np.arange(self._window_count)[:, None], self._windows] = True
+        self._incidence = self._contains[:-1, :-1].T.astype(np.float32)
+
+    def _build_neighbourhood(self):
+        m = LineDirection
+        up, right = m.VERTICAL.value[0], m.HORIZONTAL.value[1]
+        down, left = m.VERTICAL.value[1], m.HORIZONTAL.value[0]
+        up_right, down_right = m.ANTI_DIAGONAL.value[0], m.DIAGONAL.value[1]
+        down_left, up_left = m.ANTI_DIAGONAL.value[1], m.DIAGONAL.value[0]
+        cells = range(self._size)
+        # Clockwise, so _diagonal[:, j] sits between _orthogonal[:, j] and _orthogonal[:, j + 1]
+        self._orthogonal = np.array([[self._step(i, d) for d in (up, right, down, left)] for i in cells],
+                                    dtype=np.intp).reshape(-1, 4)
+        self._diagonal = np.array([[self._step(i, d) for d in (up_right, down_right, down_left, up_left)]
+                                   for i in cells], dtype=np.intp).reshape(-1, 4)
+
+    def encode(self, board) -> np.ndarray:
+        # Color codes with a trailing occupied sentinel cell for off-board lookups
+        grid = np.fromiter((self._codes[c] if c else 0 for c in board.cells), dtype=np.int8, count=self._size)
+        return np.append(grid, np.int8(-1))
+
+    def _ray_runs(self, grid: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        # runs[ray, i * colors + color]: balls of that color met walking from
+        # cells[i] along a ray (ray = 2 * direction + side) before anything else
+        codes = np.arange(1, len(self.colors) + 1, dtype=np.int8)
+        runs = np.zeros((2 * len(LineDirection), len(cells), len(codes)), dtype=np.intp)
+        for ray in range(len(runs)):
+            d, side = divmod(ray, 2)
+            alive = np.ones(runs.shape[1:], dtype=bool)
+            for k in range(self._ray_length):
+                alive &= grid[self._rays[d, side, k, cells]][:, None] == codes
+                if not alive.any():
+                    break
+                runs[ray] += alive
+        return runs.reshape(len(runs), -1)
+
+    def evaluate(self, board) -> MoveFeatures:
+        items = self.items_in_line
+        n_colors = len(self.colors)
+        grid = self.encode(board)
+
+        labels, region_count = board.empty_regions()
+        labels = np.array(labels + [0], dtype=np.intp)
+
+        balls = np.flatnonzero(grid[:-1] > 0)
+        empties = np.flatnonzero(grid[:-1] == 0)
+        ball_colors = (grid[balls] - 1).astype(np.intp)
+
+        # A ball can reach every empty cell of the regions touching it
+        ball_adjacent = labels[self._orthogonal[balls]]
+        adjacency = np.zeros((len(balls), region_count + 1), dtype=bool)
+        adjacency[np.arange(len(balls))[:, None], ball_adjacent] = True
+        adjacency[:, 0] = False
+        ball_index, target_index = np.nonzero(adjacency[:, labels[empties]])
+        b, t = balls[ball_index], empties[target_index]
+        ci = ball_colors[ball_index]
+        key = target_index * n_colors + ci
+        rows = np.arange(len(b))
+
+        # Features are tabulated per (target, color) and per ball, then only
+        # the pairs whose ball sits on a line through the target are corrected.
+        relation = self._relation[t, b]
+        distance = self._distance[t, b]
+        on_ray = relation >= 0
+        relation = np.where(on_ray, relation, 0)
+
+        # Lines through the target once the ball has left its cell
+        runs = self._ray_runs(grid, empties)[:, key]
+        cut = on_ray & (distance <= runs[relation, rows])
+        runs[relation[cut], rows[cut]] = distance[cut] - 1
+        lengths = 1 + runs[0::2] + runs[1::2]
+
+        complete = lengths >= items
+        first = complete.argmax(axis=0)
+        score = np.where(complete.any(axis=0), 5 * lengths[first, rows], 0)
+
+        # Boards too small for a line have no windows and no open-window changes
+        open_windows = np.zeros((n_colors, len(b)), dtype=np.intp)
+        if self._window_count:
+            # Window counts per color; the padding window row stays all-zero
+            color_counts = np.zeros((self._window_count + 1, n_colors + 1), dtype=np.intp)
+            window_cells = grid[self._windows]
+            for code in range(n_colors + 1):
+                color_counts[:-1, code] = (window_cells == code).sum(axis=1)
+            own, free = color_counts[:, 1:], color_counts[:, [0]]
+            open_ = (own > 0) & (own + free == items)
+            same = np.eye(n_colors, dtype=bool)
+            # Open-window change per window [w, moved color, color] when the
+            # moved ball lands in it, and when it leaves it
+            lands = (same & (own + free == items)[:, :, None]).astype(np.intp) - open_[:, None, :]
+            leaves = np.where(same, -(open_ & (own == 1)).astype(np.intp)[:, :, None],
+                              ((own > 0) & (own + free == items - 1))[:, None, :])
+
+            # Sum the per-window changes over the windows of every cell at once
+            per_cell = self._incidence @ np.concatenate([lands[:-1], leaves[:-1]], axis=1).reshape(
+                self._window_count, -1).astype(np.float32)
+            per_cell = per_cell.round().astype(np.intp).reshape(self._size, 2, n_colors, n_colors)
+            landing = per_cell[empties, 0].reshape(-1, n_colors).T
+            leaving = per_cell[balls, 1, ball_colors].T
+            open_windows[:] = landing[:, key] + leaving[:, ball_index]
+            near = np.flatnonzero(on_ray & (distance < items))
+            if len(near):
+                # Windows holding both cells keep their counts; they all run
+                # along the direction joining the two cells
+                windows = self._cell_windows[t[near], relation[near] // 2]
+                shared = self._contains[windows, b[near, None]]
+                both = lands[windows, ci[near, None]] + leaves[windows, ci[near, None]]
+                open_windows[:, near] -= (both * shared[..., None]).sum(axis=1).T
+
+        # Region count change: freeing the ball merges the regions around it,
+        # filling the target may split its region into the locally separated
+        # groups of empty neighbours, estimated from the ring of eight cells
+        # around it. Both terms assume the cells are far apart, so the sum is
+        # never too low but can be too high; pairs within two cells of each
+        # other are recomputed exactly below.
+        ordered = np.sort(ball_adjacent, axis=1)
+        joined = (ordered[:, 0] > 0).astype(np.intp) + (
+            (ordered[:, 1:] != ordered[:, :-1]) & (ordered[:, 1:] > 0)).sum(axis=1)
+        empty = grid == 0
+        orthogonal = empty[self._orthogonal[empties]]
+        diagonal = empty[self._diagonal[empties]]
+        links = (orthogonal & np.roll(orthogonal, -1, axis=1) & diagonal).sum(axis=1)
+        groups = orthogonal.sum(axis=1) - links
+        groups = np.where(orthogonal.any(axis=1) & (groups == 0), 1, groups)
+        region_delta = (1 - joined[ball_index]) + (groups[target_index] - 1)
+        by, bx = np.divmod(b, self.width)
+        ty, tx = np.divmod(t, self.width)
+        close = np.flatnonzero((np.abs(by - ty) <= 2) & (np.abs(bx - tx) <= 2))
+        if len(close):
+            region_delta[close] = self._region_deltas(board, labels, groups[target_index[close]], b[close], t[close])
+
+        return MoveFeatures(
+            balls=b,
+            targets=t,
+            colors=ci,
+            score=score,
+            line_length=lengths.max(axis=0),
+            lines_extended=(lengths >= 2).sum(axis=0),
+            open_windows=open_windows,
+            region_delta=region_delta
+        )
+
+    def _region_deltas(self, board, labels: np.ndarray, groups: np.ndarray, balls: np.ndarray,
+                       targets: np.ndarray) -> np.ndarray:
+        # Exact region count change. Filling the target splits its region
+        # into pieces, the freed ball cell then joins the pieces and other
+        # regions next to it into one: the change is pieces - joined. A
+        # target whose ring has one group leaves its region in one piece;
+        # for the others the ring cells are flood filled, once per target.
+        target_labels = labels[targets]
+        sizes = np.bincount(labels[:-1], minlength=len(labels))
+        pieces = np.where(sizes[target_labels] > 1, 1, 0)
+
+        keys = labels[self._orthogonal[balls]]
+        keys[self._orthogonal[balls] == targets[:, None]] = 0
+        keys[(keys == target_labels[:, None]) & (keys > 0)] = -1
+        split = np.flatnonzero((groups > 1) & (pieces > 0))
+        if len(split):
+            # Many of these targets only look like they split their region:
+            # the pieces of the ring meet further away and the flood stops
+            # there. The others get their pieces numbered, telling apart the
+            # neighbours of the ball that fall in different ones.
+            bitboard = BitBoard.from_board(board)
+            split_targets, which = np.unique(targets[split], return_inverse=True)
+            bits = bitboard.bits
+            empty = bitboard.empty
+            cell_labels = labels.tolist()
+            cut, starts, numbers, parts = [], [], [], []
+            for row, (target, around) in enumerate(zip(split_targets.tolist(),
+                                                       self._orthogonal[split_targets].tolist())):
+                ring = sum(bits[n] for n in around if cell_labels[n])
+                pieces_of_target = bitboard.split(ring, empty & ~bits[target])
+                if len(pieces_of_target) > 1:
+                    cut.append(row)
+                    starts.append(len(parts))
+                    numbers += range(1, len(pieces_of_target) + 1)
+                    parts += pieces_of_target
+            piece_of = np.zeros((len(split_targets), self._size + 1), dtype=np.intp)
+            if cut:
+                # Pieces of one target are disjoint, so their numbered cells
+                # add up to the target's row
+                cells = bitboard.to_arrays(parts) * np.array(numbers)[:, None]
+                piece_of[cut, :-1] = np.add.reduceat(cells, starts, axis=0)
+            ids = piece_of[which[:, None], self._orthogonal[balls[split]]]
+            pieces[split] = np.maximum(piece_of.max(axis=1)[which], 1)
+            keys[split] = np.where((keys[split] == -1) & (ids > 0), -ids, keys[split])
+
+        ordered = np.sort(keys, axis=1)
+        joined = (ordered[:, 0] != 0).astype(np.intp) + (
+            (ordered[:, 1:] != ordered[:, :-1]) & (ordered[:, 1:] != 0)).sum(axis=1)
+        return pieces - joined
+
+    def values(self, features: MoveFeatures, next_spawn: list = ()) -> np.ndarray:
+        weights = self.WEIGHTS
+        rows = np.arange(len(features.balls))
+        own = features.open_windows[features.colors, rows]
+        others = features.open_windows.sum(axis=0) - own
+        overwritten = np.isin(features.targets, list(next_spawn)) & (features.score == 0)
+        return (
+            weights["score"] * features.score
+            + weights["line_length"] * features.line_length
+            + weights["lines_extended"] * features.lines_extended
+            + weights["own_windows"] * own
+            + weights["other_windows"] * others
+            + weights["region_delta"] * features.region_delta
+            + weights["overwritten"] * overwritten
+        )
+
+    def rank(self, board, limit: int = 10, next_spawn: list = ()) -> list:
+        # Best limit moves by value (all of them for None), ties in move order
+        features = self.evaluate(board)
+        values = self.values(features, next_spawn)
+        if limit is not None and limit < len(values):
+            # Only moves at least as good as the limit-th best are sorted
+            kth = -np.partition(-values, limit - 1)[limit - 1]
+            chosen = np.flatnonzero(values >= kth)
+        else:
+            chosen = np.arange(len(values))
+        order = chosen[np.argsort(-values[chosen], kind="stable")][:limit]
+        own = features.open_windows[features.colors[order], order]
+        columns = (features.balls[order], features.targets[order], values[order], features.score[order],
+                   features.line_length[order], features.lines_extended[order], own,
+                   features.region_delta[order])
+        return [CandidateMove(*move) for move in zip(*(column.tolist() for column in columns))]
+
+    def best_move(self, board, next_spawn: list = ()):
+        moves = self.rank(board, limit=1, next_spawn=next_spawn)
+        return moves[0] if moves else None
@@ -0,0 +1,203 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+
+def _label(func: tuple) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{name}"
+
+
+class SessionProfiler:
+    # Wraps a play session in cProfile and tracemalloc. stop() writes the raw
+    # .pstats, a text report and a .folded file (one "a;b;c microseconds"
+    # line per stack, the input format of flamegraph.pl and speedscope).
+    # While running, the handlers are replaced on their classes by wrappers
+    # that add up the memory each call allocates, freed or not.
+    TOP_FUNCTIONS = 30
+    TOP_ALLOCATIONS = 20
+    TRACEBACK_DEPTH = 25
+
+    def __init__(self, handlers: list = (), output_dir: str = "./profiles"):
+        self.handlers = list(handlers)
+        self.output_dir = output_dir
+        self._profile = None
+        self._started = None
+        self._allocated = {}
+        self._calls = []
+        self._wrapped = []
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        self.start()
+
+    def start(self):
+        if self.running:
+            return
+        tracemalloc.start(self.TRACEBACK_DEPTH)
+        self._allocated = {}
+        self._wrap_handlers()
+        self._started = time.time()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self) -> str:
+        if not self.running:
+            return None
+        self._profile.disable()
+        self._unwrap_handlers()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        tracemalloc.stop()
+        profile, self._profile = self._profile, None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, time.strftime("session-%Y%m%d-%H%M%S", time.localtime(self._started)))
+        suffix = 1
+        while os.path.exists(base + ".pstats"):
+            suffix += 1
+            base = base.rsplit("~", 1)[0] + f"~{suffix}"
+        profile.dump_stats(base + ".pstats")
+        stats = pstats.Stats(profile)
+
+        with open(base + ".txt", "w") as report:
+            report.write(self.report(stats, snapshot, time.time() - self._started))
+        with open(base + ".folded", "w") as folded:
+            folded.writelines(f"{stack} {value}\n" for stack, value in self.folded_stacks(stats))
+        return base + ".txt"
+
+    def _wrap_handlers(self):
+        for handler in self.handlers:
+            # The class the handler was looked up on, found from its name
+            owner = sys.modules.get(handler.__module__)
+            for part in handler.__qualname__.split(".")[:-1]:
+                owner = getattr(owner, part, None)
+            if owner is not None and owner.__dict__.get(handler.__name__) is handler:
+                setattr(owner, handler.__name__, self._measured(handler))
+                self._wrapped.append((owner, handler))
+
+    def _unwrap_handlers(self):
+        for owner, handler in self._wrapped:
+            setattr(owner, handler.__name__, handler)
+        self._wrapped = []
+
+    def _measured(self, handler):
+        # tracemalloc has no running total of allocated bytes, so a call's
+        # allocations are its peak traced memory above the memory at entry.
+        # The peak is reset on entry; a nested call hands its peak on to the
+        # call it runs in.
+        name = handler.__qualname__
+        calls = self._calls
+        allocated = self._allocated
+
+        @functools.wraps(handler)
+        def measured(*args, **kwargs):
+            current, peak = tracemalloc.get_traced_memory()
+            if calls:
+                calls[-1][1] = max(calls[-1][1], peak)
+            tracemalloc.reset_peak()
+            calls.append([current, current])
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                start, high = calls.pop()
+                peak = max(high, tracemalloc.get_traced_memory()[1])
+                if calls:
+                    calls[-1][1] = max(calls[-1][1], peak)
+                allocated[name] = allocated.get(name, 0) + peak - start
+        return measured
+
+    def _handler_keys(self) -> dict:
+        keys = {}
+        for handler in self.handlers:
+            code = handler.__code__
+            keys[(code.co_filename, code.co_firstlineno, code.co_name)] = handler.__qualname__
+        return keys
+
+    def report(self, stats: pstats.Stats, snapshot: tracemalloc.Snapshot, duration: float) -> str:
+        out = io.StringIO()
+        out.write(f"Profiled session: {duration:.1f} s, {stats.total_calls} calls, {stats.total_tt:.3f} s in Python\n\n")
+
+        out.write("Handlers\n")
+        out.write(f"{'handler':40} {'calls':>10} {'own s':>10} {'total s':>10} {'ms/call':>10} "
+                  f"{'alloc KiB':>10} {'live KiB':>10}\n")
+        live = self.handler_allocations(snapshot)
+        for key, name in self._handler_keys().items():
+            cc, nc, tt, ct, callers = stats.stats.get(key, (0, 0, 0.0, 0.0, {}))
+            per_call = ct / nc * 1000 if nc else 0.0
+            out.write(f"{name:40} {nc:>10} {tt:>10.3f} {ct:>10.3f} {per_call:>10.3f} "
+                      f"{self._allocated.get(name, 0) / 1024:>10.1f} {live.get(name, 0) / 1024:>10.1f}\n")
+        out.write("alloc: memory allocated by all calls, freed or not; live: still allocated at stop\n")
+
+        out.write(f"\nTop {self.TOP_FUNCTIONS} functions by cumulative time\n")
+        stats.stream = out
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.TOP_FUNCTIONS)
+
+        out.write(f"\nTop {self.TOP_ALLOCATIONS} allocation sites still alive at stop\n")
+        for stat in snapshot.statistics("lineno")[:self.TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            out.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {frame.filename}:{frame.lineno}\n")
+        return out.getvalue()
+
+    def handler_allocations(self, snapshot: tracemalloc.Snapshot) -> dict:
+        # Bytes of allocations made while a handler was on the stack and
+        # still alive at stop
+        ranges = []
+        for handler in self.handlers:
+            code = handler.__code__
+            lines = [line for start, end, line in code.co_lines() if line is not None]
+            ranges.append((handler.__qualname__, code.co_filename, code.co_firstlineno, max(lines, default=0)))
+
+        allocated = {}
+        for stat in snapshot.statistics("traceback"):
+            for name, filename, first, last in ranges:
+                if any(f.filename == filename and first <= f.lineno <= last for f in stat.traceback):
+                    allocated[name] = allocated.get(name, 0) + stat.size
+        return allocated
+
+    @staticmethod
+    def folded_stacks(stats: pstats.Stats, min_us: int = 1, max_depth: int = 64) -> list:
+        # cProfile only keeps caller -> callee edges, so stacks are rebuilt
+        # from the roots down, splitting each callee's time between its
+        # callers in proportion to the cumulative time spent under each.
+        children = {}
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            for caller in callers:
+                children.setdefault(caller, []).append(func)
+
+        result = []
+
+        def walk(func, stack, share):
+            cc, nc, tt, ct, callers = stats.stats[func]
+            own = int(tt * share * 1e6)
+            if own >= min_us:
+                result.append((";".join(_label(f) for f in stack), own))
+            if len(stack) >= max_depth:
+                return
+            for child in children.get(func, ()):
+                if child in stack:
+                    continue
+                child_ct = stats.stats[child][3]
+                from_here = stats.stats[child][4][func][3]
+                child_share = share * from_here / child_ct if child_ct else 0.0
+                if child_ct * child_share * 1e6 >= min_us:
+                    walk(child, stack + [child], child_share)
+
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            if not callers:
+                walk(func, [func], 1.0)
+        return result
@@ -0,0 +1,358 @@
+import argparse
+import json
+import sys
+from collections import namedtuple
+from itertools import count
+from multiprocessing import Pool
+from random import Random
+
+from board import Board, COLORS
+from engine import LinesGame
+from move_scoring import MoveEvaluator
+
+# cells: the starting position, spawns: the balls added after each move that
+# does not clear a line (one list of (cell, color) pairs per move, the first
+# one is the preview shown on the board), solution: (ball, target) moves
+Puzzle = namedtuple("Puzzle", ["width", "height", "moves", "cells", "spawns", "solution"])
+
+
+class PuzzleSolver:
+    # Shortest sequence of moves that clears a line, with the game's rules:
+    # balls travel over 4-connected empty cells, only the moved ball can
+    # complete a line of items_in_line, a move that clears nothing is
+    # followed by the next spawn, which overwrites whatever is on its cells.
+    #
+    # The search is iterative deepening with a lower bound per window of
+    # items_in_line cells and color: a cell already holding the color (or
+    # getting it from a spawn within the horizon) costs 0, an empty cell 1,
+    # a ball of another color 2 (it has to move out first). One move lowers
+    # the cost of a window by at most 1, so only windows the root can finish
+    # within the move limit are ever looked at again.
+    def __init__(self, width: int = 10, height: int = 10, items_in_line: int = LinesGame.ITEMS_IN_LINE,
+                 colors: tuple = COLORS):
+        self.width = width
+        self.height = height
+        self.items_in_line = items_in_line
+        self.colors = tuple(colors)
+        self.neighbours = Board.neighbour_table(width, height)
+        self.windows = self._build_windows()
+        self.nodes = 0
+
+    def _build_windows(self) -> list:
+        windows = []
+        for y in range(self.height):
+            for x in range(self.width):
+                for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_y, end_x = y + dy * (self.items_in_line - 1), x + dx * (self.items_in_line - 1)
+                    if 0 <= end_y < self.height and 0 <= end_x < self.width:
+                        windows.append(tuple((y + dy * k) * self.width + x + dx * k
+                                             for k in range(self.items_in_line)))
+        return windows
+
+    @staticmethod
+    def _spawned_colors(spawns: list) -> dict:
+        colors = {}
+        for batch in spawns:
+            for index, color in batch:
+                colors.setdefault(index, set()).add(color)
+        return colors
+
+    @staticmethod
+    def _cost(cells: list, window: tuple, color: str, spawned: dict) -> int:
+        cost = 0
+        for index in window:
+            if cells[index] == color or color in spawned.get(index, ()):
+                continue
+            cost += 1 if cells[index] is None else 2
+        return cost
+
+    def solve(self, cells: list, spawns: list = (), max_moves: int = 3) -> list:
+        # Shortest solution of at most max_moves moves, or None. spawns[k]
+        # follows move k; only the first max_moves - 1 are ever used.
+        self.nodes = 0
+        spawns = [[tuple(s) for s in batch] for batch in spawns]
+        spawned = self._spawned_colors(spawns[:max_moves - 1])
+        candidates = []
+        for window in self.windows:
+            for color in self.colors:
+                cost = self._cost(cells, window, color, spawned)
+                if cost <= max_moves:
+                    candidates.append((max(1, cost), window, color))
+        if not candidates:
+            return None
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        for depth in range(candidates[0][0], max_moves + 1):
+            useful = [(window, color) for cost, window, color in candidates if cost <= depth]
+            solution = self._search(list(cells), spawns, 0, depth, useful, set())
+            if solution is not None:
+                return solution
+        return None
+
+    def _search(self, cells: list, spawns: list, done: int, depth: int, candidates: list, visited: set):
+        self.nodes += 1
+        left = depth - done
+        key = (tuple(cells), done)
+        if key in visited:
+            return None
+        visited.add(key)
+
+        board = Board(self.width, self.height, cells)
+        labels, regions = board.empty_regions()
+        if left == 1:
+            move = self._finishing_move(cells, labels, candidates)
+            return None if move is None else [move]
+
+        spawned = self._spawned_colors(spawns[done:depth - 1])
+        costs = [(self._cost(cells, window, color, spawned), window, color) for window, color in candidates]
+        bound = max(1, min(cost for cost, window, color in costs))
+        if bound > left:
+            return None
+
+        if bound == left:
+            moves = self._tight_moves(cells, labels, [(w, c) for cost, w, c in costs if cost == left], spawned)
+        else:
+            moves = self._all_moves(cells, labels)
+
+        children = []
+        for ball, target in moves:
+            child = list(cells)
+            child[target], child[ball] = child[ball], None
+            if Board(self.width, self.height, child).line_at(target, self.items_in_line) is not None:
+                return [(ball, target)]
+            for index, color in spawns[done] if done < len(spawns) else ():
+                child[index] = color
+            later = self._spawned_colors(spawns[done + 1:depth - 1])
+            child_bound = max(1, min(self._cost(child, w, c, later) for w, c in candidates))
+            if child_bound <= left - 1:
+                children.append((child_bound, ball, target, child))
+
+        children.sort(key=lambda child: child[0])
+        for child_bound, ball, target, child in children:
+            solution = self._search(child, spawns, done + 1, depth, candidates, visited)
+            if solution is not None:
+                return [(ball, target)] + solution
+        return None
+
+    def _reaches(self, ball: int, label: int, labels: list) -> bool:
+        return any(labels[n] == label for n in self.neighbours[ball])
+
+    def _finishing_move(self, cells: list, labels: list, candidates: list):
+        for window, color in candidates:
+            gaps = [index for index in window if cells[index] != color]
+            if len(gaps) != 1 or cells[gaps[0]] is not None:
+                continue
+            target = gaps[0]
+            for ball, ball_color in enumerate(cells):
+                if ball_color == color and ball not in window and self._reaches(ball, labels[target], labels):
+                    return ball, target
+        return None
+
+    def _tight_moves(self, cells: list, labels: list, tight: list, spawned: dict) -> list:
+        # With no moves to spare every move has to lower the cost of one of
+        # the windows at the limit: bring the color into an empty cell, or
+        # take a ball of another color out of the window. A cell a spawn
+        # will give the color costs 0 whatever is on it, so for this it
+        # counts as outside the window, both to move from and to move to.
+        moves = set()
+        for window, color in tight:
+            inside = {index for index in window if color not in spawned.get(index, ())}
+            for index in inside:
+                if cells[index] == color:
+                    continue
+                if cells[index] is None:
+                    for ball, ball_color in enumerate(cells):
+                        if ball_color == color and ball not in inside and self._reaches(ball, labels[index], labels):
+                            moves.add((ball, index))
+                else:
+                    reached = {labels[n] for n in self.neighbours[index]} - {0}
+                    moves.update((index, target) for target, label in enumerate(labels)
+                                 if label in reached and target not in inside)
+        return sorted(moves)
+
+    def _all_moves(self, cells: list, labels: list) -> list:
+        members = {}
+        for index, label in enumerate(labels):
+            if label:
+                members.setdefault(label, []).append(index)
+        moves = []
+        for ball, color in enumerate(cells):
+            if color is None:
+                continue
+            for label in {labels[n] for n in self.neighbours[ball]} - {0}:
+                moves.extend((ball, target) for target in members[label])
+        return moves
+
+
+def play_solution(width: int, height: int, cells: list, spawns: list, solution: list,
+                  items_in_line: int = LinesGame.ITEMS_IN_LINE) -> bool:
+    # Independent check of a solution: every move needs a path and only the
+    # last one clears a line
+    board = Board(width, height, cells)
+    for turn, (ball, target) in enumerate(solution):
+        if board.cells[ball] is None or board.cells[target] is not None or not board.find_path(ball, target):
+            return False
+        board.cells[target], board.cells[ball] = board.cells[ball], None
+        cleared = board.line_at(target, items_in_line) is not None
+        if cleared != (turn == len(solution) - 1):
+            return False
+        if not cleared:
+            for index, color in spawns[turn]:
+                board.cells[index] = color
+    return True
+
+
+def shortest_solution_length(width: int, height: int, cells: list, spawns: list, max_moves: int,
+                             items_in_line: int = LinesGame.ITEMS_IN_LINE) -> int:
+    # Brute force over every sequence of legal moves, for checking the
+    # solver on small boards: the fewest moves that clear a line, or None
+    # if max_moves are not enough
+    level = {tuple(cells)}
+    for moves in range(1, max_moves + 1):
+        children = set()
+        for position in level:
+            board = Board(width, height, position)
+            for ball in board.balls():
+                for target in board.reachable(ball):
+                    child = list(position)
+                    child[target], child[ball] = child[ball], None
+                    if Board(width, height, child).line_at(target, items_in_line) is not None:
+                        return moves
+                    for index, color in spawns[moves - 1] if moves - 1 < len(spawns) else ():
+                        child[index] = color
+                    children.add(tuple(child))
+        level = children
+    return None
+
+
+class PuzzleGenerator:
+    # Positions come from games played by MoveEvaluator with some random
+    # moves mixed in. The spawns are the game's preview followed by draws
+    # from the same random generator, and a position is kept when the
+    # solver's shortest solution takes exactly the requested number of moves.
+    RANDOM_MOVES = 0.3
+    TURNS = (5, 60)
+    # Boards up to this many cells also get a brute-force check that no
+    # shorter solution exists
+    BRUTE_FORCE_CELLS = 36
+
+    def __init__(self, width: int = 10, height: int = 10, moves: int = 3):
+        self.width = width
+        self.height = height
+        self.moves = moves
+        self.evaluator = MoveEvaluator(width, height, LinesGame.ITEMS_IN_LINE)
+        self.solver = PuzzleSolver(width, height)
+
+    def position(self, seed: int) -> tuple:
+        # (cells, spawns) of a game interrupted after a random number of
+        # turns, or None if it was lost before that
+        rng = Random(seed)
+        game = LinesGame(self.width, self.height, seed)
+        for turn in range(rng.randint(*self.TURNS)):
+            if rng.random() < self.RANDOM_MOVES:
+                ball = rng.choice(game.board.balls())
+                targets = sorted(game.board.reachable(ball))
+                if not targets:
+                    continue
+                game.apply_move(ball, rng.choice(targets))
+            else:
+                move = self.evaluator.best_move(game.board)
+                if move is None:
+                    return None
+                game.apply_move(move.ball, move.target)
+            if game.lost:
+                return None
+
+        cells = list(game.board.cells)
+        spawns = [[(index, game.next_color[index]) for index in game.next_spawn]]
+        free = [index for index, color in enumerate(cells) if color is None and index not in game.next_spawn]
+        for turn in range(self.moves - 2):
+            batch = []
+            for k in range(min(game.SPAWN_PER_TURN, len(free))):
+                index = free.pop(rng.randrange(len(free)))
+                batch.append((index, rng.choice(game.colors)))
+            spawns.append(batch)
+        return cells, spawns
+
+    def generate(self, seed: int) -> Puzzle:
+        position = self.position(seed)
+        if position is None:
+            return None
+        cells, spawns = position
+        solution = self.solver.solve(cells, spawns, self.moves)
+        if solution is None or len(solution) != self.moves:
+            return None
+        if not play_solution(self.width, self.height, cells, spawns, solution):
+            raise RuntimeError(f"Solver returned an invalid solution for seed {seed}")
+        if self.width * self.height <= self.BRUTE_FORCE_CELLS and shortest_solution_length(
+                self.width, self.height, cells, spawns, self.moves - 1) is not None:
+            raise RuntimeError(f"Solver missed a shorter solution for seed {seed}")
+        return Puzzle(self.width, self.height, self.moves, cells, spawns[:self.moves - 1], solution)
+
+
+_generator = None
+
+
+def _init_worker(width: int, height: int, moves: int):
+    global _generator
+    _generator = PuzzleGenerator(width, height, moves)
+
+
+def _generate(seed: int) -> Puzzle:
+    return _generator.generate(seed)
+
+
+def generate_puzzles(width: int = 10, height: int = 10, moves: int = 3, number: int = 100, seed: int = 0,
+                     processes: int = None, chunk: int = 256):
+    # Yields number puzzles, trying seeds seed, seed + 1, ... in worker
+    # processes. The result depends only on the arguments, not on timing.
+    seeds = count(seed)
+    with Pool(processes, initializer=_init_worker, initargs=(width, height, moves)) as pool:
+        while number > 0:
+            batch = [next(seeds) for _ in range(chunk)]
+            for puzzle in pool.imap(_generate, batch, chunksize=8):
+                if puzzle is not None and number > 0:
+                    number -= 1
+                    yield puzzle
+
+
+def save_puzzle(puzzle: Puzzle) -> str:
+    return json.dumps({
+        "width": puzzle.width,
+        "height": puzzle.height,
+        "moves": puzzle.moves,
+        "cells": puzzle.cells,
+        "spawns": [[list(s) for s in batch] for batch in puzzle.spawns],
+        "solution": [list(move) for move in puzzle.solution],
+    })
+
+
+def load_puzzle(line: str) -> Puzzle:
+    data = json.loads(line)
+    return Puzzle(data["width"], data["height"], data["moves"], data["cells"],
+                  [[tuple(s) for s in batch] for batch in data["spawns"]],
+                  [tuple(move) for move in data["solution"]])
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Generate \"clear a line in N moves\" puzzles.")
+    parser.add_argument("--size", type=int, nargs=2, default=(10, 10), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("-n", "--moves", type=int, default=3, help="moves needed to clear a line")
+    parser.add_argument("-c", "--count", type=int, default=100, help="number of puzzles")
+    parser.add_argument("--seed", type=int, default=0, help="first game seed")
+    parser.add_argument("-o", "--output", help="JSON lines file (default: stdout)")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for puzzle in generate_puzzles(args.size[0], args.size[1], args.moves, args.count, args.seed,
+                                       args.processes):
+            output.write(save_puzzle(puzzle) + "\n")
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+
+from engine import LinesGame, TurnResult
+from game_stats import GameStatsStore
+from move_scoring import MoveEvaluator
+
+
+class GameRecording:
+    # A game as JSON lines: a header with the starting position, then one
+    # line per turn with the path, cleared line, spawns and new previews.
+    # Spawns are stored rather than re-drawn from the seed, so games that
+    # used undo replay as they were played.
+    def __init__(self, width: int = 10, height: int = 10, seed: int = None, cells: list = None,
+                 next_spawn: list = ()):
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.cells = list(cells) if cells is not None else [None] * (width * height)
+        self.next_spawn = [tuple(s) for s in next_spawn]
+        self.turns = []
+
+    @classmethod
+    def start(cls, game: LinesGame):
+        return cls(game.width, game.height, game.seed, game.board.cells, cls._previews(game))
+
+    @staticmethod
+    def _previews(game: LinesGame) -> list:
+        return [(index, game.next_color[index]) for index in game.next_spawn]
+
+    def add_turn(self, turn: TurnResult, game: LinesGame):
+        self.turns.append({
+            "ball": turn.ball,
+            "target": turn.target,
+            "path": list(turn.path),
+            "line": list(turn.line),
+            "score": turn.score,
+            "spawned": [list(s) for s in turn.spawned],
+            "next_spawn": [list(s) for s in self._previews(game)],
+        })
+
+    def positions(self):
+        # (cells, next_spawn, scores) before every turn and after the last one
+        cells = list(self.cells)
+        next_spawn = list(self.next_spawn)
+        scores = 0
+        yield list(cells), next_spawn, scores
+        for turn in self.turns:
+            cells[turn["target"]], cells[turn["ball"]] = cells[turn["ball"]], None
+            for index in turn["line"]:
+                cells[index] = None
+            for index, color in turn["spawned"]:
+                cells[index] = color
+            next_spawn = [tuple(s) for s in turn["next_spawn"]]
+            scores += turn["score"]
+            yield list(cells), next_spawn, scores
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            header = {"width": self.width, "height": self.height, "seed": self.seed,
+                      "cells": self.cells, "next_spawn": [list(s) for s in self.next_spawn]}
+            f.write(json.dumps(header) + "\n")
+            for turn in self.turns:
+                f.write(json.dumps(turn) + "\n")
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            recording = cls(header["width"], header["height"], header.get("seed"), header["cells"],
+                            header["next_spawn"])
+            recording.turns = [json.loads(line) for line in f if line.strip()]
+        return recording
+
+
+def record_bot_game(width: int = 10, height: int = 10, seed: int = None, max_turns: int = None,
+                    stats: GameStatsStore = None) -> GameRecording:
+    # Plays MoveEvaluator's best move every turn, optionally adding the game
+    # to a stats store
+    game = LinesGame(width, height, seed)
+    evaluator = MoveEvaluator(width, height, game.ITEMS_IN_LINE, tuple(game.colors))
+    recording = GameRecording.start(game)
+    while not game.lost and (max_turns is None or game.turns < max_turns):
+        move = evaluator.best_move(game.board)
+        if move is None:
+            break
+        recording.add_turn(game.move(move.ball, move.target), game)
+    if stats is not None and game.turns > 0:
+        stats.record(game.game_record("bot"))
+    return recording
@@ -0,0 +1,224 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+from multiprocessing import Pool
+
+from PyQt5.QtCore import Qt, QRect, QMargins
+from PyQt5.QtGui import QGuiApplication, QImage, QPainter, QColor
+
+from replay import GameRecording, record_bot_game
+
+# Frame timing follows GameField: one path step per 25 ms tick
+FPS = 40
+# Qt maps PNG quality 80 to a fast zlib level; lower levels barely speed up
+# the encoder, which manages about 50 frames per second and core
+PNG_QUALITY = 80
+HOLD_FRAMES = 8
+CLEAR_FRAMES = 12
+BLINK_FRAMES = 3
+
+
+def frame_plan(recording: GameRecording) -> list:
+    # (kind, turn, step) for every frame; positions[turn] is the board the
+    # frame starts from
+    plan = [("hold", 0, 0)] * HOLD_FRAMES
+    for t, turn in enumerate(recording.turns):
+        plan += [("travel", t, k) for k in range(1, len(turn["path"]))]
+        if turn["line"]:
+            plan += [("clear", t, k) for k in range(CLEAR_FRAMES)]
+        plan += [("hold", t + 1, 0)] * HOLD_FRAMES
+    return plan
+
+
+class FrameRenderer:
+    # Draws frames the way FieldItem.paintEvent draws the field, on a QImage
+    # with Qt's raster engine; needs a QGuiApplication but no display.
+    def __init__(self, recording: GameRecording, cell_size: int = 70, image_dir: str = "./img"):
+        self.recording = recording
+        self.cell_size = cell_size
+        self.positions = list(recording.positions())
+        self.plan = frame_plan(recording)
+        self._base_key = None
+        self._base = None
+
+        scale = cell_size / 70
+        self._ball_margin = int(5 * scale)
+        self._next_margin = int(25 * scale)
+        colors = {c for cells, next_spawn, scores in self.positions for c in cells if c}
+        colors |= {c for cells, next_spawn, scores in self.positions for i, c in next_spawn}
+        self.images = {}
+        for color in colors:
+            image = QImage(os.path.join(image_dir, f"{color}.png"))
+            self.images[color] = (
+                image.scaled(cell_size - 2 * self._ball_margin, cell_size - 2 * self._ball_margin,
+                             Qt.KeepAspectRatio, Qt.SmoothTransformation),
+                image.scaled(max(1, cell_size - 2 * self._next_margin), max(1, cell_size - 2 * self._next_margin),
+                             Qt.KeepAspectRatio, Qt.SmoothTransformation),
+            )
+
+    @property
+    def frame_size(self) -> tuple:
+        return self.recording.width * self.cell_size, self.recording.height * self.cell_size
+
+    def __len__(self):
+        return len(self.plan)
+
+    def _rect(self, index: int) -> QRect:
+        y, x = divmod(index, self.recording.width)
+        return QRect(x * self.cell_size, y * self.cell_size, self.cell_size, self.cell_size)
+
+    def _draw_ball(self, painter: QPainter, index: int, color: str, preview: bool = False):
+        image = self.images[color][1 if preview else 0]
+        rect = self._rect(index)
+        painter.drawImage(rect.center().x() - image.width() // 2, rect.center().y() - image.height() // 2, image)
+
+    def render(self, frame: int) -> QImage:
+        # Consecutive frames of one turn share the board picture; only the
+        # travelling ball is drawn per frame
+        kind, t, step = self.plan[frame]
+        key = (kind, t, (step // BLINK_FRAMES) % 2 if kind == "clear" else 0)
+        if key != self._base_key:
+            self._base_key, self._base = key, self._draw_board(*key)
+        if kind != "travel":
+            return self._base
+
+        turn = self.recording.turns[t]
+        image = self._base.copy()
+        painter = QPainter(image)
+        self._draw_ball(painter, turn["path"][step], self.positions[t][0][turn["ball"]])
+        painter.end()
+        return image
+
+    def _draw_board(self, kind: str, t: int, blink: int) -> QImage:
+        cells, next_spawn, scores = self.positions[t]
+        cells = list(cells)
+        highlight = []
+
+        if kind == "travel":
+            # As in GameField.animate_move the selected ball stays in its cell
+            # while a copy walks the path
+            highlight = [self.recording.turns[t]["ball"]]
+        elif kind == "clear":
+            # The moved ball has landed; the line blinks before it is removed
+            turn = self.recording.turns[t]
+            cells[turn["target"]], cells[turn["ball"]] = cells[turn["ball"]], None
+            highlight = turn["line"]
+            if blink:
+                for index in turn["line"]:
+                    cells[index] = None
+
+        width, height = self.frame_size
+        image = QImage(width, height, QImage.Format_RGB888)
+        image.fill(QColor("#e1e1e1"))
+        painter = QPainter(image)
+        painter.setPen(QColor("#adadad"))
+        for index in range(len(cells)):
+            rect = self._rect(index)
+            if index in highlight:
+                painter.fillRect(rect, QColor("#f0f0f0"))
+            painter.drawRect(rect.marginsRemoved(QMargins(0, 0, 1, 1)))
+
+        if kind != "clear":
+            for index, color in next_spawn:
+                if not cells[index]:
+                    self._draw_ball(painter, index, color, preview=True)
+        for index, color in enumerate(cells):
+            if color:
+                self._draw_ball(painter, index, color)
+        painter.end()
+        return image
+
+
+_renderer = None
+_application = None
+
+
+def _init_worker(recording: GameRecording, cell_size: int, image_dir: str):
+    global _renderer, _application
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    _application = QGuiApplication.instance() or QGuiApplication(["replay_render"])
+    _renderer = FrameRenderer(recording, cell_size, image_dir)
+
+
+def _render_png(job: tuple) -> int:
+    # Hold and blink frames repeat the previous picture, which render()
+    # hands back unchanged; their file is copied instead of encoded again
+    start, end, pattern = job
+    previous = None
+    for frame in range(start, end):
+        image = _renderer.render(frame)
+        if image is previous:
+            shutil.copyfile(pattern % (frame - 1), pattern % frame)
+        else:
+            image.save(pattern % frame, "PNG", PNG_QUALITY)
+        previous = image
+    return end - start
+
+
+def _render_raw(job: tuple) -> bytes:
+    start, end = job
+    chunks = []
+    for frame in range(start, end):
+        image = _renderer.render(frame)
+        if image.bytesPerLine() == image.width() * 3:
+            chunks.append(image.constBits().asstring(image.sizeInBytes()))
+        else:
+            # Scanlines are padded to 4 bytes
+            for y in range(image.height()):
+                chunks.append(image.constScanLine(y).asstring(image.width() * 3))
+    return b"".join(chunks)
+
+
+def render(recording: GameRecording, output: str = None, raw=None, cell_size: int = 70, image_dir: str = "./img",
+           processes: int = None, chunk: int = 32) -> int:
+    # Writes numbered PNGs to the output directory, or RGB24 frames in order
+    # to the raw binary stream. Returns the number of frames.
+    frames = len(frame_plan(recording))
+    jobs = [(start, min(start + chunk, frames)) for start in range(0, frames, chunk)]
+    with Pool(processes, initializer=_init_worker, initargs=(recording, cell_size, image_dir)) as pool:
+        if raw is not None:
+            for data in pool.imap(_render_raw, jobs):
+                raw.write(data)
+        else:
+            os.makedirs(output, exist_ok=True)
+            # Frames left from an earlier, longer render would run on after this one
+            for stale in glob.glob(os.path.join(output, "frame_" + "[0-9]" * 6 + ".png")):
+                os.remove(stale)
+            pattern = os.path.join(output, "frame_%06d.png")
+            sum(pool.imap_unordered(_render_png, [job + (pattern,) for job in jobs]))
+    return frames
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Render a recorded game to frames without a display.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("replay", nargs="?", help="recorded game (.jsonl)")
+    source.add_argument("--bot-seed", type=int, help="record and render a bot game with this seed")
+    parser.add_argument("--size", type=int, nargs=2, default=(10, 10), metavar=("WIDTH", "HEIGHT"),
+                        help="board size of the bot game")
+    parser.add_argument("--max-turns", type=int, help="stop the bot game after this many turns")
+    parser.add_argument("-o", "--output", default="frames",
+                        help="directory for numbered PNGs, replacing any frame_*.png there; one process encodes "
+                             f"about 50 new frames a second, near real time at {FPS} fps, so use -j or --raw for more")
+    parser.add_argument("--raw", action="store_true",
+                        help=f"write raw RGB24 frames to stdout instead (e.g. ffmpeg -f rawvideo -pix_fmt rgb24 -r {FPS})")
+    parser.add_argument("--cell-size", type=int, default=70)
+    parser.add_argument("--images", default="./img", help="directory with the ball images")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        recording = GameRecording.load(args.replay)
+    else:
+        recording = record_bot_game(args.size[0], args.size[1], args.bot_seed, args.max_turns)
+
+    raw = sys.stdout.buffer if args.raw else None
+    frames = render(recording, args.output, raw, args.cell_size, args.images, args.processes)
+    width, height = recording.width * args.cell_size, recording.height * args.cell_size
+    print(f"{frames} frames of {width}x{height} at {FPS} fps ({len(recording.turns)} turns)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,13 @@ from PyQt5.QtCore import QObject
 from PyQt5.QtGui import QImage
 from PyQt5.QtMultimedia import QSound
 
+from board import COLORS
+
 
 class Images(QObject):
     def __init__(self):
         self.empty = QImage()
-        self.colors = {
-            "blue": QImage("./img//blue.png"),
-            "cyan": QImage("./img//cyan.png"),
-            "green": QImage("./img//green.png"),
-            "orange": QImage("./img//orange.png"),
-            "red": QImage("./img//red.png"),
-            "yellow": QImage("./img//yellow.png")
-        }
+        self.colors = {color: QImage(f"./img//{color}.png") for color in COLORS}
 
 
 class Sounds(QObject):